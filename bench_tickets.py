@@ -0,0 +1,553 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import itertools
+import tempfile
+import contextlib
+import tracemalloc
+import importlib.util
+from typing import Optional
+from collections import Counter
+
+import discord
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "newfile (1).py")
+SNOWFLAKES = itertools.count(10 ** 17)
+DEFAULT_LIMITS = {
+    "create_channel": ("guild", "10/1"),
+    "edit_channel": ("channel", "5/1"),
+    "delete_channel": ("guild", "10/1"),
+    "edit_permissions": ("channel", "5/1"),
+    "send_message": ("channel", "5/1"),
+    "history": ("channel", "5/1"),
+    "interaction_callback": ("interaction", "1/1"),
+    "webhook": ("guild", "50/1"),
+    "get_member": ("guild", "10/1"),
+    "edit_message": ("channel", "5/1"),
+}
+
+def parse_limit(text: str):
+    count, per = text.split("/")
+    return int(count), float(per)
+
+class RateBucket:
+    def __init__(self, limit: int, per: float):
+        self.limit = limit
+        self.per = per
+        self.tokens = limit
+        self.reset_at = None
+
+    async def acquire(self) -> float:
+        loop = asyncio.get_running_loop()
+        waited = 0.0
+        while True:
+            now = loop.time()
+            if self.reset_at is None or now >= self.reset_at:
+                self.tokens = self.limit
+                self.reset_at = now + self.per
+            if self.tokens > 0:
+                self.tokens -= 1
+                return waited
+            delay = self.reset_at - now
+            waited += delay
+            await asyncio.sleep(delay)
+
+class FakeRest:
+    def __init__(self, latency: float, jitter: float, limits: dict):
+        self.latency = latency
+        self.jitter = jitter
+        self.limits = limits
+        self.buckets = {}
+        self.calls = Counter()
+        self.rate_limited = Counter()
+        self.waited = 0.0
+
+    async def call(self, route: str, scope_id: int):
+        key = (route, scope_id)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = RateBucket(*self.limits[route])
+        waited = await bucket.acquire()
+        if waited:
+            self.rate_limited[route] += 1
+            self.waited += waited
+        self.calls[route] += 1
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+class FakeHTTPResponse:
+    def __init__(self, status: int):
+        self.status = status
+        self.reason = "Not Found"
+
+class FakeRole:
+    def __init__(self, role_id: int, name: str):
+        self.id = role_id
+        self.name = name
+        self.mention = f"<@&{role_id}>"
+
+class FakeMember:
+    discriminator = "0"
+    global_name = None
+    bot = False
+    system = False
+    avatar = None
+    default_avatar = None
+    display_avatar = None
+    avatar_decoration = None
+    avatar_decoration_sku_id = None
+
+    def __init__(self, user_id: int, manage: bool = False):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.display_name = self.name
+        self.mention = f"<@{user_id}>"
+        self.guild_permissions = discord.Permissions(manage_channels=manage)
+
+    def __str__(self):
+        return self.name
+
+    def mentioned_in(self, message) -> bool:
+        return False
+
+class FakeMessage:
+    def __init__(self, channel: "FakeTextChannel", author: FakeMember, content: str, embeds: list):
+        self.id = next(SNOWFLAKES)
+        self.channel = channel
+        self.author = author
+        self.content = content or ""
+        self.embeds = embeds
+        self.attachments = []
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+
+class FakePartialMessage:
+    def __init__(self, channel: "FakeTextChannel", message_id: int):
+        self.channel = channel
+        self.id = message_id
+
+    async def edit(self, **kwargs):
+        await self.channel.guild.rest.call("edit_message", self.channel.id)
+        if not any(m.id == self.id for m in self.channel.log):
+            raise discord.NotFound(FakeHTTPResponse(404), "Unknown Message")
+
+class FakeCategory(discord.CategoryChannel):
+    def __init__(self, guild: "FakeGuild", name: str):
+        self.guild = guild
+        self.id = next(SNOWFLAKES)
+        self.name = name
+        self.position = 0
+        self.category_id = None
+        self.children = []
+
+    @property
+    def overwrites(self):
+        return {}
+
+    @property
+    def channels(self):
+        return list(self.children)
+
+    @property
+    def text_channels(self):
+        return list(self.children)
+
+class FakeTextChannel(discord.TextChannel):
+    def __init__(self, guild: "FakeGuild", name: str, category: Optional[FakeCategory] = None,
+                 overwrites: Optional[dict] = None):
+        self.guild = guild
+        self.id = next(SNOWFLAKES)
+        self.name = name
+        self.category_id = category.id if category else None
+        self.perms = dict(overwrites or {})
+        self.log = []
+
+    @property
+    def overwrites(self):
+        return dict(self.perms)
+
+    async def send(self, content=None, **kwargs):
+        await self.guild.rest.call("send_message", self.id)
+        embeds = [kwargs["embed"]] if kwargs.get("embed") else []
+        message = FakeMessage(self, self.guild.me, content, embeds)
+        self.log.append(message)
+        return message
+
+    async def edit(self, **kwargs):
+        await self.guild.rest.call("edit_channel", self.id)
+        if "name" in kwargs:
+            self.name = kwargs["name"]
+        if "overwrites" in kwargs:
+            self.perms = dict(kwargs["overwrites"])
+
+    async def set_permissions(self, target, *, overwrite=None, reason=None):
+        await self.guild.rest.call("edit_permissions", self.id)
+        self.perms = {t: ow for t, ow in self.perms.items() if t.id != target.id}
+        if overwrite is not None:
+            self.perms[target] = overwrite
+
+    def get_partial_message(self, message_id: int) -> FakePartialMessage:
+        return FakePartialMessage(self, message_id)
+
+    async def delete(self, reason=None):
+        await self.guild.rest.call("delete_channel", self.guild.id)
+        self.guild.remove_channel(self)
+
+    async def history(self, limit=None, oldest_first=False):
+        messages = self.log if oldest_first else list(reversed(self.log))
+        for start in range(0, len(messages), 100):
+            await self.guild.rest.call("history", self.id)
+            for message in messages[start:start + 100]:
+                yield message
+
+class FakeGuild:
+    def __init__(self, rest: FakeRest, lean_members: bool = False):
+        self.rest = rest
+        self.lean_members = lean_members
+        self.id = next(SNOWFLAKES)
+        self.default_role = FakeRole(self.id, "@everyone")
+        self.me = FakeMember(next(SNOWFLAKES), manage=True)
+        self.channels = {}
+        self.members = {}
+        self.roles = {}
+
+    def add_member(self, manage: bool = False) -> FakeMember:
+        member = FakeMember(next(SNOWFLAKES), manage)
+        member.guild = self
+        self.members[member.id] = member
+        return member
+
+    def add_role(self, name: str) -> FakeRole:
+        role = FakeRole(next(SNOWFLAKES), name)
+        self.roles[role.id] = role
+        return role
+
+    def add_category(self, name: str) -> FakeCategory:
+        category = FakeCategory(self, name)
+        self.channels[category.id] = category
+        return category
+
+    def add_text_channel(self, name: str, category: Optional[FakeCategory] = None,
+                         overwrites: Optional[dict] = None) -> FakeTextChannel:
+        channel = FakeTextChannel(self, name, category, overwrites)
+        self.channels[channel.id] = channel
+        if category:
+            category.children.append(channel)
+        return channel
+
+    def remove_channel(self, channel: FakeTextChannel):
+        self.channels.pop(channel.id, None)
+        category = self.channels.get(channel.category_id)
+        if category:
+            category.children.remove(channel)
+
+    @property
+    def categories(self):
+        return [c for c in self.channels.values() if isinstance(c, FakeCategory)]
+
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+
+    def get_member(self, user_id: int):
+        if self.lean_members and user_id != self.me.id:
+            return None
+        return self.members.get(user_id)
+
+    async def fetch_member(self, user_id: int):
+        await self.rest.call("get_member", self.id)
+        member = self.members.get(user_id)
+        if member is None:
+            raise discord.NotFound(FakeHTTPResponse(404), "Unknown Member")
+        return member
+
+    def get_role(self, role_id: int):
+        return self.roles.get(role_id)
+
+    async def create_text_channel(self, name: str, category: Optional[FakeCategory] = None,
+                                  overwrites: Optional[dict] = None, reason: Optional[str] = None):
+        await self.rest.call("create_channel", self.id)
+        if category and len(category.children) >= 50:
+            raise RuntimeError("Maximum number of channels in category reached (50)")
+        return self.add_text_channel(name, category, overwrites)
+
+class FakeResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self) -> bool:
+        return self.done
+
+    async def defer(self, **kwargs):
+        await self.interaction.rest.call("interaction_callback", self.interaction.id)
+        self.done = True
+
+    async def send_message(self, content=None, **kwargs):
+        await self.interaction.rest.call("interaction_callback", self.interaction.id)
+        self.done = True
+        self.interaction.record(content)
+
+class FakeFollowup:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        await self.interaction.rest.call("webhook", self.interaction.guild.id)
+        self.interaction.record(content)
+
+class FakeInteraction:
+    def __init__(self, guild: FakeGuild, user: FakeMember, channel: FakeTextChannel):
+        self.id = next(SNOWFLAKES)
+        self.rest = guild.rest
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = user
+        self.channel = channel
+        self.channel_id = channel.id
+        self.message = None
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.finished = asyncio.Event()
+        self.outcome = None
+
+    def record(self, content: Optional[str]):
+        if content and content[0] in "✅❌":
+            self.outcome = content
+            self.finished.set()
+
+class LoopMonitor:
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.blocked = 0.0
+        self.worst = 0.0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - start - self.interval
+            if lag > 0:
+                self.blocked += lag
+                self.worst = max(self.worst, lag)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+
+async def load_bot(workdir: str, preload: int, guild_id: int):
+    os.chdir(workdir)
+    spec = importlib.util.spec_from_file_location("ticketbot", BOT_PATH)
+    bot = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(bot)
+    os.makedirs(bot.guild_dir(guild_id))
+    tickets = {str(next(SNOWFLAKES)): {"owner_id": next(SNOWFLAKES), "handler_id": None} for _ in range(preload)}
+    with open(os.path.join(bot.guild_dir(guild_id), "tickets.json"), "w", encoding="utf-8") as f:
+        json.dump(tickets, f)
+    bot.load_state()
+    start = time.perf_counter()
+    state = await bot.PARTITIONS.get(guild_id)
+    return bot, state, time.perf_counter() - start
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+async def run_phase(name: str, jobs: list, concurrency: int, results: dict):
+    gate = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def run(job):
+        nonlocal errors
+        async with gate:
+            start = time.perf_counter()
+            try:
+                await job()
+            except Exception as e:
+                errors += 1
+                print(f"[{name}] error: {e!r}", file=sys.stderr)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run(job) for job in jobs))
+    wall = time.perf_counter() - start
+    results[name] = {
+        "ops": len(jobs),
+        "errors": errors,
+        "seconds": round(wall, 3),
+        "ops_per_sec": round(len(jobs) / wall, 1) if wall else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+async def benchmark(args) -> dict:
+    limits = {route: parse_limit(getattr(args, f"limit_{route}", None) or default) for route, (_, default) in DEFAULT_LIMITS.items()}
+    rest = FakeRest(args.latency, args.jitter, limits)
+    workdir = tempfile.mkdtemp(prefix="ticket-bench-")
+    if args.tracemalloc:
+        tracemalloc.start()
+    guild = FakeGuild(rest, lean_members=args.member_cache == "lean")
+    os.environ["MEMBER_CACHE"] = args.member_cache
+    bot, state, load_seconds = await load_bot(workdir, args.tickets, guild.id)
+    primary = guild.add_category("Tickets")
+    for _ in range(args.ops // 45):
+        guild.add_category("Tickets")
+    panel = guild.add_text_channel("panel")
+    write_role = guild.add_role("writers")
+    mention_role = guild.add_role("support")
+    state.set("config", ["write_role_id"], write_role.id)
+    state.set("config", ["mention_role_id"], mention_role.id)
+    staff = [guild.add_member(manage=True) for _ in range(max(2, args.concurrency // 4))]
+    users = [guild.add_member() for _ in range(args.ops)]
+    results = {}
+    monitor = LoopMonitor()
+    monitor.start()
+    bot.DELETE_BATCH = args.delete_batch
+    bot.LIFECYCLE.resolve_channel = guild.get_channel
+    bot.RENDERER.partial_message = lambda _, channel_id, message_id: guild.get_channel(channel_id).get_partial_message(message_id)
+    scheduler = asyncio.create_task(bot.LIFECYCLE.run())
+    quiet = open(os.devnull, "w") if not args.verbose else None
+    with contextlib.redirect_stdout(quiet) if quiet else contextlib.nullcontext():
+        def command_job(command, member, channel, **params):
+            async def job():
+                interaction = FakeInteraction(guild, member, channel)
+                await bot.TREE.get_command(command).callback(interaction, **params)
+                if interaction.outcome and interaction.outcome.startswith("❌"):
+                    raise RuntimeError(interaction.outcome)
+            return job
+
+        panel_channels = [guild.add_text_channel(f"panel-{i}") for i in range(args.panels)]
+        await run_phase("new-ticket", [command_job("new-ticket", staff[0], ch, message=f"panel {i}", button_label="Support",
+                                                   category=primary, button_color="green")
+                                       for i, ch in enumerate(panel_channels)], args.concurrency, results)
+        await run_phase("add-button-ticket", [command_job("add-button-ticket", staff[0], ch, message_id=str(ch.log[-1].id),
+                                                          button_label="Billing", category=primary, button_color="blue")
+                                              for ch in panel_channels if ch.log], args.concurrency, results)
+        await run_phase("message-ticket", [command_job("message-ticket", staff[0], panel, category=primary, text=f"welcome {i}")
+                                           for i in range(args.panels)], args.concurrency, results)
+        button = bot.OpenTicketButton("Support", discord.ButtonStyle.success, primary.id)
+        opened = []
+
+        def open_job(user):
+            async def job():
+                interaction = FakeInteraction(guild, user, panel)
+                await button.callback(interaction)
+                await asyncio.wait_for(interaction.finished.wait(), args.timeout)
+                if not interaction.outcome.startswith("✅"):
+                    raise RuntimeError(interaction.outcome)
+                opened.append((user, state.owners.open_for(user.id)))
+            return job
+
+        await run_phase("open", [open_job(u) for u in users], args.concurrency, results)
+        channels = [(user, guild.get_channel(next(iter(ids)))) for user, ids in opened if ids]
+
+        def button_job(cls, member, channel):
+            async def job():
+                await cls().callback(FakeInteraction(guild, member, channel))
+            return job
+
+        await run_phase("accept", [button_job(bot.AcceptTicketButton, staff[i % len(staff)], ch)
+                                   for i, (_, ch) in enumerate(channels)], args.concurrency, results)
+        await run_phase("convert", [command_job("convert", staff[i % len(staff)], ch, user=staff[(i + 1) % len(staff)])
+                                    for i, (_, ch) in enumerate(channels)], args.concurrency, results)
+        await run_phase("rename", [command_job("rename", staff[i % len(staff)], ch, name=f"done-{i}")
+                                   for i, (_, ch) in enumerate(channels)], args.concurrency, results)
+        await bot.PERMISSIONS.drain()
+        await run_phase("message-receipt", [command_job("message-receipt", staff[0], panel, text=f"receipt {i}")
+                                            for i in range(args.ops)], args.concurrency, results)
+        await run_phase("close", [button_job(bot.CloseTicketButton, staff[(i + 1) % len(staff)], ch)
+                                  for i, (_, ch) in enumerate(channels) if i % 2 == 0], args.concurrency, results)
+        await run_phase("close-cmd", [command_job("close", staff[(i + 1) % len(staff)], ch)
+                                      for i, (_, ch) in enumerate(channels) if i % 2 == 1], args.concurrency, results)
+        start = time.perf_counter()
+        while state.get("lifecycle")["deletions"]:
+            await asyncio.sleep(0.05)
+        results["close-cmd"]["drain_seconds"] = round(time.perf_counter() - start, 3)
+        leftover = [ch.id for _, ch in channels if ch.id in guild.channels]
+        if leftover:
+            results["close-cmd"]["errors"] += len(leftover)
+            print(f"[close] {len(leftover)} ticket channels were not deleted", file=sys.stderr)
+        scheduler.cancel()
+        await bot.PARTITIONS.close()
+        await bot.PROCESS.close()
+    if quiet:
+        quiet.close()
+    await monitor.stop()
+    report = {
+        "member_cache": args.member_cache,
+        "tickets_preloaded": args.tickets,
+        "load_state_seconds": round(load_seconds, 4),
+        "phases": results,
+        "rest_calls": dict(rest.calls),
+        "rate_limited": dict(rest.rate_limited),
+        "rate_limit_wait_seconds": round(rest.waited, 3),
+        "loop_blocked_seconds": round(monitor.blocked, 4),
+        "loop_worst_stall_ms": round(monitor.worst * 1000, 2),
+        "max_rss_mb": round(max_rss_mb(), 1),
+    }
+    if args.tracemalloc:
+        report["traced_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+        tracemalloc.stop()
+    return report
+
+def max_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == "darwin" else rss / 1024
+
+def print_report(report: dict):
+    print(f"member cache: {report['member_cache']}  tickets preloaded: {report['tickets_preloaded']}  load_state: {report['load_state_seconds'] * 1000:.1f}ms")
+    print(f"{'phase':<16}{'ops':>7}{'err':>6}{'ops/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for name, row in report["phases"].items():
+        print(f"{name:<16}{row['ops']:>7}{row['errors']:>6}{row['ops_per_sec']:>10}{row['p50_ms']:>10}{row['p99_ms']:>10}")
+    print(f"REST calls: {report['rest_calls']}")
+    print(f"rate limited: {report['rate_limited']} ({report['rate_limit_wait_seconds']}s summed wait)")
+    print(f"event loop blocked: {report['loop_blocked_seconds']}s (worst stall {report['loop_worst_stall_ms']}ms)")
+    print(f"max RSS: {report['max_rss_mb']}MB" + (f", traced peak: {report['traced_peak_mb']}MB" if "traced_peak_mb" in report else ""))
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the ticket bot against a fake Discord backend.")
+    parser.add_argument("--ops", type=int, default=200, help="tickets opened (and then accepted/converted/renamed/closed)")
+    parser.add_argument("--tickets", type=int, default=1000, help="existing tickets preloaded into the store")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="mean simulated REST latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.005)
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for a queued ticket open")
+    for route, (scope, default) in DEFAULT_LIMITS.items():
+        parser.add_argument(f"--limit-{route.replace('_', '-')}", dest=f"limit_{route}", default=default,
+                            help=f"rate-limit bucket per {scope} as COUNT/SECONDS (default {default})")
+    parser.add_argument("--panels", type=int, default=10, help="panels created by /new-ticket and extended by /add-button-ticket")
+    parser.add_argument("--delete-batch", type=int, default=5, help="channels the lifecycle scheduler deletes per second")
+    parser.add_argument("--member-cache", choices=("full", "lean"), default="full",
+                        help="lean: guild.get_member misses and owners are resolved through fetch_member")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report traced Python heap peak (slower)")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--fail-p99-ms", type=float, default=None, help="exit 1 if any phase p99 exceeds this")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's own stdout")
+    args = parser.parse_args()
+    report = asyncio.run(benchmark(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    failed = any(row["errors"] for row in report["phases"].values())
+    if args.fail_p99_ms is not None:
+        failed = failed or any(row["p99_ms"] > args.fail_p99_ms for row in report["phases"].values())
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,178 @@
-try:
-    import discord
-except ImportError:
-    import sys, subprocess
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "-q", "discord.py>=2.3.2"])
-    import discord
+import discord
+import aiohttp
 
 import os
+import copy
+import gzip
+import html
 import json
+import math
+import time
+import heapq
+import bisect
+import hashlib
 import asyncio
+import functools
+import contextlib
+import contextvars
+import collections
 from typing import Optional, List, Tuple
 from discord import app_commands
 from discord.ext import commands
 
+MEMBER_CACHE_MODE = "lean" if os.getenv("MEMBER_CACHE", "full").lower() == "lean" else "full"
+LEAN_MEMBERS = MEMBER_CACHE_MODE == "lean"
+
 INTENTS = discord.Intents.default()
 INTENTS.guilds = True
-INTENTS.members = True
+INTENTS.members = not LEAN_MEMBERS or os.getenv("MEMBERS_INTENT") == "1"
 INTENTS.message_content = False
 
-BOT = commands.Bot(command_prefix="!", intents=INTENTS)
+PROCESS_START = time.monotonic()
+STARTUP_TIMINGS = {}
+
+@contextlib.contextmanager
+def startup_phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = time.perf_counter() - start
+
+def resident_memory_mb() -> float:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if os.uname().sysname == "Darwin" else rss / 1024
+
+def parse_shard_ids(spec: Optional[str]) -> Optional[List[int]]:
+    if not spec:
+        return None
+    ids = set()
+    for part in spec.split(","):
+        first, _, last = part.strip().partition("-")
+        ids.update(range(int(first), int(last or first) + 1))
+    return sorted(ids)
+
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = parse_shard_ids(os.getenv("SHARD_IDS"))
+SYNC_GUILD_ID = int(os.getenv("SYNC_GUILD_ID", "0")) or None
+
+class TicketBot(commands.AutoShardedBot):
+    async def setup_hook(self):
+        install_instrumentation()
+        if METRICS_PORT:
+            await asyncio.start_server(serve_metrics, "127.0.0.1", METRICS_PORT)
+        with startup_phase("load_state"):
+            load_state()
+        with startup_phase("register_items"):
+            register_persistent_items()
+        with startup_phase("command_sync"):
+            await sync_commands()
+        PARTITIONS.start()
+        CHANNEL_POOL.start()
+        LIFECYCLE.start()
+
+    async def close(self):
+        await PERMISSIONS.drain()
+        await super().close()
+        await PARTITIONS.close()
+        await PROCESS.close()
+
+TRANSPORT_SECONDS = contextvars.ContextVar("transport_seconds", default=None)
+
+async def on_transport_start(session, ctx, params):
+    ctx.mark = time.perf_counter()
+
+async def on_transport_progress(session, ctx, params):
+    spent = TRANSPORT_SECONDS.get()
+    now = time.perf_counter()
+    if spent is not None:
+        spent[0] += now - ctx.mark
+    ctx.mark = now
+
+HTTP_TRACE = aiohttp.TraceConfig()
+HTTP_TRACE.on_request_start.append(on_transport_start)
+HTTP_TRACE.on_request_end.append(on_transport_progress)
+HTTP_TRACE.on_response_chunk_received.append(on_transport_progress)
+HTTP_TRACE.on_request_exception.append(on_transport_progress)
+
+BOT = TicketBot(
+    command_prefix="!",
+    intents=INTENTS,
+    shard_count=SHARD_COUNT,
+    shard_ids=SHARD_IDS,
+    member_cache_flags=discord.MemberCacheFlags.none() if LEAN_MEMBERS else discord.MemberCacheFlags.from_intents(INTENTS),
+    chunk_guilds_at_startup=not LEAN_MEMBERS,
+    http_trace=HTTP_TRACE,
+)
 TREE = BOT.tree
 
 DATA_DIR = "data"
-FILES = {
-    "config": os.path.join(DATA_DIR, "config.json"),
-    "buttons": os.path.join(DATA_DIR, "buttons.json"),
-    "tickets": os.path.join(DATA_DIR, "tickets.json"),
-    "categories": os.path.join(DATA_DIR, "categories.json"),
-}
+GUILDS_DIR = os.path.join(DATA_DIR, "guilds")
+SHARD_KEY = "shards-" + "_".join(str(i) for i in SHARD_IDS) if SHARD_IDS else "shards-all"
+PROCESS_DIR = os.path.join(DATA_DIR, SHARD_KEY)
 
 DEFAULTS = {
     "config": {
-        "guild_id": None,
         "mention_role_id": None,
         "write_role_id": None,
         "in_ticket_buttons": {
             "close_label": "قفل التذكرة",
             "accept_label": "استلام التذكرة"
         },
-        "receipt_message": "✅ تم استلام هذه التذكرة. سيتم التعامل معها قريبًا."
+        "receipt_message": "✅ تم استلام هذه التذكرة. سيتم التعامل معها قريبًا.",
+        "channel_pool_size": 0,
+        "controls_version": 0,
+        "transcripts": {
+            "enabled": True,
+            "html": False,
+            "attachments": True
+        },
+        "inactivity": {
+            "warn_hours": 0,
+            "close_hours": 0
+        }
     },
     "buttons": {},
     "tickets": {},
-    "categories": {}
+    "categories": {},
+    "pool": {},
+    "panels": {},
+    "lifecycle": {
+        "deletions": {}
+    },
+    "stats": {
+        "ready": False,
+        "open_by_category": {},
+        "open_by_handler": {},
+        "time_to_accept": {},
+        "time_to_close": {}
+    }
 }
 
+PROCESS_DEFAULTS = {
+    "meta": {
+        "command_sync": {},
+        "startup": {}
+    },
+    "wakeups": {}
+}
+
+LEGACY_FILES = {name: os.path.join(DATA_DIR, f"{name}.json") for name in DEFAULTS}
+LEGACY_JOURNAL = os.path.join(DATA_DIR, "journal.jsonl")
+LEGACY_BACKUP_DIR = os.path.join(DATA_DIR, "legacy")
+
+def guild_dir(guild_id: int) -> str:
+    return os.path.join(GUILDS_DIR, str(guild_id))
+
 COLOR_TO_STYLE = {
     "green": discord.ButtonStyle.success,
     "red": discord.ButtonStyle.danger,
@@ -52,24 +181,1256 @@ COLOR_TO_STYLE = {
     "white": discord.ButtonStyle.secondary,
 }
 
-def ensure_files():
-    os.makedirs(DATA_DIR, exist_ok=True)
-    for key, path in FILES.items():
+METRIC_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(METRIC_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(METRIC_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return METRIC_BUCKETS[i] if i < len(METRIC_BUCKETS) else float("inf")
+        return 0.0
+
+class Metrics:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram()
+        hist.observe(value)
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0.0) + amount
+
+    def render(self) -> str:
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), hist in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, n in zip(METRIC_BUCKETS + (float("inf"),), hist.counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {hist.total}")
+            lines.append(f"{name}_count{format_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+def format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        parts.append(f'{key}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+METRICS = Metrics()
+CURRENT_HANDLER = contextvars.ContextVar("current_handler", default=None)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+def instrumented(name: str):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            token = CURRENT_HANDLER.set((name, start))
+            status = "ok"
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                status = "error"
+                raise
+            finally:
+                CURRENT_HANDLER.reset(token)
+                METRICS.observe("ticket_handler_seconds", time.perf_counter() - start, handler=name)
+                METRICS.inc("ticket_handler_total", handler=name, status=status)
+        return wrapper
+    return decorator
+
+def timed_response(method):
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        current = CURRENT_HANDLER.get()
+        start = time.perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            METRICS.observe("rest_call_seconds", end - start, route="interaction_callback")
+            METRICS.inc("rest_calls_total", route="interaction_callback")
+            if current:
+                METRICS.observe("interaction_response_seconds", end - current[1], handler=current[0])
+    return wrapper
+
+RATE_LIMIT_MIN_WAIT = 0.05
+
+def install_instrumentation():
+    http = BOT.http
+    original = http.request
+
+    async def request(route, **kwargs):
+        start = time.perf_counter()
+        label = f"{route.method} {route.path}"
+        transport = [0.0]
+        token = TRANSPORT_SECONDS.set(transport)
+        try:
+            return await original(route, **kwargs)
+        finally:
+            TRANSPORT_SECONDS.reset(token)
+            elapsed = time.perf_counter() - start
+            waited = elapsed - transport[0]
+            if waited >= RATE_LIMIT_MIN_WAIT:
+                METRICS.inc("rate_limit_waits_total")
+                METRICS.inc("rate_limit_wait_seconds_total", waited)
+            METRICS.observe("rest_call_seconds", elapsed, route=label)
+            METRICS.inc("rest_calls_total", route=label)
+
+    http.request = request
+    for method_name in ("defer", "send_message", "edit_message"):
+        setattr(discord.InteractionResponse, method_name, timed_response(getattr(discord.InteractionResponse, method_name)))
+
+async def serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    with contextlib.suppress(Exception):
+        await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+    body = METRICS.render().encode("utf-8")
+    writer.write(
+        b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+        + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii")
+        + body
+    )
+    with contextlib.suppress(ConnectionError):
+        await writer.drain()
+    writer.close()
+
+def apply_op(data: dict, op: dict):
+    node = data[op["n"]]
+    *parents, leaf = op["p"]
+    for key in parents:
+        node = node.setdefault(key, {})
+    if op["op"] == "set":
+        node[leaf] = op["v"]
+    else:
+        node.pop(leaf, None)
+
+def dump_document(value, f):
+    # One top-level entry per line keeps each json call small, so a snapshot
+    # written from a worker thread never holds the GIL for the whole document.
+    if not isinstance(value, dict):
+        f.write(json.dumps(value, ensure_ascii=False, separators=(",", ":")))
+        return
+    f.write("{")
+    separator = "\n"
+    for key, item in value.items():
+        f.write(separator + json.dumps(str(key), ensure_ascii=False) + ":"
+                + json.dumps(item, ensure_ascii=False, separators=(",", ":")))
+        separator = ",\n"
+    f.write("\n}")
+
+def load_document(f):
+    first = f.readline()
+    if first != "{\n":
+        return json.loads(first + f.read())
+    document = {}
+    for line in f:
+        line = line.rstrip("\n")
+        if line == "}":
+            break
+        document.update(json.loads("{" + line.rstrip(",") + "}"))
+    return document
+
+COMPACT_DELAY = 5.0
+COMPACT_EVERY = 500
+
+class StateStore:
+    def __init__(self, files: dict, defaults: dict, journal_path: str):
+        self.files = files
+        self.defaults = defaults
+        self.journal_path = journal_path
+        self.rotated_path = journal_path + ".1"
+        self.data = {}
+        self.loaded = False
+        self._journal = None
+        self._dirty = set()
+        self._pending = 0
+        self._compact_task: Optional[asyncio.Task] = None
+        self._compact_lock = asyncio.Lock()
+
+    def load(self):
+        if self.loaded:
+            return
+        os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+        for name, path in self.files.items():
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    if f.readline() != "{\n":
+                        self._dirty.add(name)
+                    f.seek(0)
+                    self.data[name] = load_document(f)
+            else:
+                self.data[name] = copy.deepcopy(self.defaults[name])
+                self._dirty.add(name)
+        replayed = self._replay(self.rotated_path, self.data) + self._replay(self.journal_path, self.data)
+        if replayed or os.path.exists(self.journal_path):
+            self._dirty.update(self.data)
+        if self._dirty:
+            self._persist({name: self.data[name] for name in self._dirty}, drop_journal=True)
+            self._dirty.clear()
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self.loaded = True
+
+    def get(self, name: str):
+        return self.data[name]
+
+    def set(self, name: str, path, value):
+        self._record({"op": "set", "n": name, "p": [str(k) for k in path], "v": value})
+
+    def delete(self, name: str, path):
+        self._record({"op": "del", "n": name, "p": [str(k) for k in path]})
+
+    def _record(self, op: dict):
+        start = time.perf_counter()
+        line = json.dumps(op, ensure_ascii=False, separators=(",", ":"))
+        self._journal.write(line + "\n")
+        self._journal.flush()
+        apply_op(self.data, json.loads(line))
+        METRICS.observe("state_io_seconds", time.perf_counter() - start, op="journal")
+        self._dirty.add(op["n"])
+        self._pending += 1
+        self._schedule_compaction()
+
+    def _replay(self, path: str, data: dict) -> int:
         if not os.path.exists(path):
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(DEFAULTS[key], f, ensure_ascii=False, indent=2)
+            return 0
+        count = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    break
+                if op["n"] not in data:
+                    data[op["n"]] = self._read_snapshot(op["n"])
+                apply_op(data, op)
+                count += 1
+        return count
+
+    def _read_snapshot(self, name: str):
+        path = self.files[name]
+        if not os.path.exists(path):
+            return copy.deepcopy(self.defaults[name])
+        with open(path, "r", encoding="utf-8") as f:
+            return load_document(f)
+
+    def _schedule_compaction(self):
+        if self._compact_task and not self._compact_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._compact_task = loop.create_task(self._compact_later())
+
+    async def _compact_later(self):
+        if self._pending < COMPACT_EVERY:
+            await asyncio.sleep(COMPACT_DELAY)
+        await asyncio.shield(self.compact())
+
+    async def compact(self):
+        async with self._compact_lock:
+            if os.path.exists(self.rotated_path) and not await self._fold_rotated():
+                return
+            if not self._dirty:
+                return
+            self._journal.close()
+            os.replace(self.journal_path, self.rotated_path)
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+            self._dirty.clear()
+            self._pending = 0
+            await self._fold_rotated()
+
+    async def _fold_rotated(self) -> bool:
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._rebuild)
+        except (OSError, ValueError) as e:
+            print("State compaction error:", e)
+            return False
+        METRICS.observe("state_io_seconds", time.perf_counter() - start, op="persist")
+        return True
+
+    async def close(self):
+        if self._compact_task and not self._compact_task.done():
+            self._compact_task.cancel()
+        await self.compact()
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+    def _rebuild(self):
+        data = {}
+        self._replay(self.rotated_path, data)
+        self._persist(data, drop_journal=False)
+
+    def _persist(self, documents: dict, drop_journal: bool):
+        for name, value in documents.items():
+            path = self.files[name]
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                dump_document(value, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+        if drop_journal and os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+PROCESS = StateStore({name: os.path.join(PROCESS_DIR, f"{name}.json") for name in PROCESS_DEFAULTS},
+                     PROCESS_DEFAULTS, os.path.join(PROCESS_DIR, "journal.jsonl"))
+
+class TicketLocks:
+    def __init__(self):
+        self._locks = {}
+        self._users = {}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, channel_id: int):
+        lock = self._locks.get(channel_id)
+        if lock is None:
+            lock = self._locks[channel_id] = asyncio.Lock()
+        self._users[channel_id] = self._users.get(channel_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[channel_id] -= 1
+            if not self._users[channel_id]:
+                del self._users[channel_id]
+                del self._locks[channel_id]
+
+class InFlightOps:
+    def __init__(self):
+        self._running = set()
+
+    def claim(self, key) -> bool:
+        if key in self._running:
+            return False
+        self._running.add(key)
+        return True
+
+    def release(self, key):
+        self._running.discard(key)
+
+TICKET_LOCKS = TicketLocks()
+IN_FLIGHT = InFlightOps()
+CLOSING_TICKETS = set()
+
+MAX_TICKETS_PER_CATEGORY = 1
+CATEGORY_CHANNEL_LIMIT = 50
+ADMISSION_CONCURRENCY = int(os.getenv("ADMISSION_CONCURRENCY", "2"))
+ADMISSION_QUEUE_LIMIT = int(os.getenv("ADMISSION_QUEUE_LIMIT", "200"))
+GUILD_CREATE_CONCURRENCY = int(os.getenv("GUILD_CREATE_CONCURRENCY", "4"))
+
+class OwnerIndex:
+    def __init__(self):
+        self._by_owner = {}
+        self._owner_of = {}
+
+    def rebuild(self, tickets: dict):
+        self._by_owner.clear()
+        self._owner_of.clear()
+        for cid, info in tickets.items():
+            self.add(int(cid), info["owner_id"])
+
+    def add(self, channel_id: int, owner_id: int):
+        self._by_owner.setdefault(owner_id, set()).add(channel_id)
+        self._owner_of[channel_id] = owner_id
+
+    def remove(self, channel_id: int):
+        owner_id = self._owner_of.pop(channel_id, None)
+        channels = self._by_owner.get(owner_id)
+        if channels is not None:
+            channels.discard(channel_id)
+            if not channels:
+                del self._by_owner[owner_id]
+
+    def open_for(self, owner_id: int) -> set:
+        return self._by_owner.get(owner_id, set())
+
+SKETCH_ACCURACY = 0.02
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+UNASSIGNED = "none"
+
+def sketch_bucket(seconds: float) -> int:
+    return math.ceil(math.log(max(seconds, 1.0), SKETCH_GAMMA))
+
+def sketch_quantile(buckets: dict, q: float) -> Optional[float]:
+    total = sum(buckets.values())
+    if not total:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for index in sorted(buckets, key=int):
+        seen += buckets[index]
+        if seen > rank:
+            return 2 * SKETCH_GAMMA ** int(index) / (SKETCH_GAMMA + 1)
+    return None
+
+class TicketStats:
+    def rebuild(self, tickets: dict) -> dict:
+        stats = copy.deepcopy(DEFAULTS["stats"])
+        stats["ready"] = True
+        for info in tickets.values():
+            self._count(stats["open_by_category"], info.get("category_id"), 1)
+            self._count(stats["open_by_handler"], info.get("handler_id"), 1)
+        return stats
+
+    def _count(self, group: dict, key, delta: int):
+        key = str(key or UNASSIGNED)
+        group[key] = group.get(key, 0) + delta
+
+    def _bump(self, state: "GuildState", group: str, key, delta: int):
+        key = str(key or UNASSIGNED)
+        value = state.get("stats")[group].get(key, 0) + delta
+        if value > 0:
+            state.set("stats", [group, key], value)
+        else:
+            state.delete("stats", [group, key])
+
+    def _observe(self, state: "GuildState", sketch: str, seconds: float):
+        index = str(sketch_bucket(seconds))
+        state.set("stats", [sketch, index], state.get("stats")[sketch].get(index, 0) + 1)
+
+    def opened(self, state: "GuildState", category_id: int):
+        self._bump(state, "open_by_category", category_id, 1)
+        self._bump(state, "open_by_handler", None, 1)
+
+    def assigned(self, state: "GuildState", channel_id: int, info: dict, handler_id: int):
+        if info.get("handler_id") != handler_id:
+            self._bump(state, "open_by_handler", info.get("handler_id"), -1)
+            self._bump(state, "open_by_handler", handler_id, 1)
+        if not info.get("accepted_at"):
+            now = time.time()
+            state.set("tickets", [channel_id, "accepted_at"], now)
+            if info.get("created_at"):
+                self._observe(state, "time_to_accept", now - info["created_at"])
+
+    def closed(self, state: "GuildState", info: dict):
+        self._bump(state, "open_by_category", info.get("category_id"), -1)
+        self._bump(state, "open_by_handler", info.get("handler_id"), -1)
+        if info.get("created_at"):
+            self._observe(state, "time_to_close", (info.get("closed_at") or time.time()) - info["created_at"])
+
+STATS = TicketStats()
+
+def report_stopped(name: str):
+    def callback(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            METRICS.inc("background_task_crashes_total", task=name)
+            print(f"⚠️ {name} stopped:", repr(task.exception()))
+    return callback
+
+PARTITION_IDLE_TTL = 900.0
+PARTITION_SWEEP_INTERVAL = 60.0
+
+class GuildState(StateStore):
+    def __init__(self, guild_id: int):
+        base = guild_dir(guild_id)
+        super().__init__({name: os.path.join(base, f"{name}.json") for name in DEFAULTS},
+                         DEFAULTS, os.path.join(base, "journal.jsonl"))
+        self.guild_id = guild_id
+        self.owners = OwnerIndex()
+        self.last_used = time.monotonic()
+
+    def load(self):
+        super().load()
+        self.owners.rebuild(self.get("tickets"))
+        if not self.get("stats").get("ready"):
+            self.data["stats"] = STATS.rebuild(self.get("tickets"))
+            self._persist({"stats": self.data["stats"]}, drop_journal=False)
+
+class GuildPartitions:
+    def __init__(self):
+        self._loaded = {}
+        self._loading = {}
+        self._task: Optional[asyncio.Task] = None
+        self.scan_on_ready = False
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._sweep_loop())
+            self._task.add_done_callback(report_stopped("Partition sweeper"))
+
+    def peek(self, guild_id: int) -> Optional[GuildState]:
+        return self._loaded.get(guild_id)
+
+    def loaded(self) -> list:
+        return list(self._loaded.values())
+
+    async def get(self, guild_id: int) -> GuildState:
+        if guild_id is None:
+            raise ValueError("guild state requested outside a guild")
+        state = self._loaded.get(guild_id)
+        if state is None:
+            future = self._loading.get(guild_id)
+            if future is None:
+                future = self._loading[guild_id] = asyncio.ensure_future(self._load(guild_id))
+                future.add_done_callback(lambda _: self._loading.pop(guild_id, None))
+            state = await asyncio.shield(future)
+        state.last_used = time.monotonic()
+        return state
+
+    async def _load(self, guild_id: int) -> GuildState:
+        state = GuildState(guild_id)
+        start = time.perf_counter()
+        await asyncio.to_thread(state.load)
+        METRICS.observe("state_io_seconds", time.perf_counter() - start, op="partition_load")
+        METRICS.inc("guild_partitions_total", event="load")
+        self._loaded[guild_id] = state
+        self.activate(state)
+        return state
+
+    def activate(self, state: GuildState):
+        CLOSING_TICKETS.update(int(cid) for cid in state.get("lifecycle")["deletions"])
+        LIFECYCLE.attach(state)
+        CHANNEL_POOL.attach(state)
+        RENDERER.schedule(state)
+
+    def pinned(self, state: GuildState) -> bool:
+        return (bool(state.get("lifecycle")["deletions"]) or ADMISSION.busy(state.guild_id)
+                or RENDERER.busy(state.guild_id))
+
+    async def evict(self, state: GuildState):
+        if self._loaded.pop(state.guild_id, None) is None:
+            return
+        LIFECYCLE.detach(state)
+        await state.close()
+        METRICS.inc("guild_partitions_total", event="evict")
+
+    async def _sweep_loop(self):
+        await BOT.wait_until_ready()
+        try:
+            legacy_pending = await migrate_legacy_state(announce=True)
+        except Exception as e:
+            print("⚠️ Legacy state migration error, retrying later:", e)
+            legacy_pending = True
+        if self.scan_on_ready:
+            for guild in BOT.guilds:
+                if os.path.isdir(guild_dir(guild.id)):
+                    try:
+                        await self.get(guild.id)
+                    except Exception as e:
+                        print(f"Partition load error for {guild.id}:", e)
+        while True:
+            await asyncio.sleep(PARTITION_SWEEP_INTERVAL)
+            if legacy_pending:
+                try:
+                    legacy_pending = await migrate_legacy_state(announce=False)
+                except Exception as e:
+                    print("⚠️ Legacy state migration error, retrying later:", e)
+            cutoff = time.monotonic() - PARTITION_IDLE_TTL
+            for state in self.loaded():
+                if state.last_used < cutoff and not self.pinned(state):
+                    try:
+                        await self.evict(state)
+                    except Exception as e:
+                        print("Partition eviction error:", e)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+        for state in self.loaded():
+            await self.evict(state)
+
+PARTITIONS = GuildPartitions()
+
+def legacy_paths() -> list:
+    return [p for p in [*LEGACY_FILES.values(), LEGACY_JOURNAL, LEGACY_JOURNAL + ".1"] if os.path.exists(p)]
+
+def legacy_entries(data: dict):
+    for name in ("tickets", "categories", "pool"):
+        for key, value in data[name].items():
+            yield name, [key], value, [int(key)]
+    for key, value in data["buttons"].items():
+        yield "buttons", [key], value, [int(b["category_id"]) for b in value]
+    for key, value in data["panels"].items():
+        yield "panels", [key], value, [int(value["channel_id"])]
+    for key, value in data["lifecycle"]["deletions"].items():
+        yield "lifecycle", ["deletions", key], value, [int(key)]
+
+def legacy_owner(channel_ids: list) -> Optional[int]:
+    for channel_id in channel_ids:
+        channel = BOT.get_channel(channel_id)
+        if channel is not None and getattr(channel, "guild", None) is not None:
+            return channel.guild.id
+    return None
+
+async def migrate_legacy_state(announce: bool) -> int:
+    if not legacy_paths():
+        return 0
+    legacy = StateStore(LEGACY_FILES, DEFAULTS, LEGACY_JOURNAL)
+    await asyncio.to_thread(legacy.load)
+    fallback = legacy.get("config").get("guild_id") or (BOT.guilds[0].id if len(BOT.guilds) == 1 else None)
+    owned, unresolved = ({int(fallback): []} if fallback else {}), set()
+    for name, path, value, channel_ids in legacy_entries(legacy.data):
+        guild_id = legacy_owner(channel_ids) or fallback
+        if guild_id:
+            owned.setdefault(int(guild_id), []).append((name, path, value))
+        else:
+            unresolved.add((name, tuple(path)))
+    if unresolved and not owned:
+        await legacy.close()
+        if announce:
+            print(f"⚠️ Legacy state in {DATA_DIR} could not be matched to any guild this bot can see "
+                  f"({len(unresolved)} entries); existing tickets and panels stay unavailable until it can.")
+        return len(unresolved)
+    for guild_id, entries in owned.items():
+        state = await PARTITIONS.get(guild_id)
+        for name, path, value in entries:
+            node = state.get(name)
+            for key in path[:-1]:
+                node = node.get(key, {})
+            if path[-1] not in node:
+                state.set(name, path, value)
+        config = state.get("config")
+        for key, value in legacy.get("config").items():
+            if key != "guild_id" and key in DEFAULTS["config"] and config.get(key) == DEFAULTS["config"][key]:
+                state.set("config", [key], value)
+        stats = STATS.rebuild(state.get("tickets"))
+        for group in ("open_by_category", "open_by_handler"):
+            state.set("stats", [group], stats[group])
+        state.owners.rebuild(state.get("tickets"))
+        PARTITIONS.activate(state)
+    if unresolved and SHARD_IDS is not None:
+        for name, path, _ in legacy_entries(legacy.data):
+            if (name, tuple(path)) not in unresolved:
+                legacy.delete(name, path)
+        await legacy.close()
+        if owned or announce:
+            print(f"⚠️ {len(unresolved)} legacy state entries in {DATA_DIR} belong to guilds outside shards {SHARD_IDS}; "
+                  f"they stay there until the owning shard migrates them.")
+        return len(unresolved)
+    await legacy.close()
+    os.makedirs(LEGACY_BACKUP_DIR, exist_ok=True)
+    for path in legacy_paths():
+        os.replace(path, os.path.join(LEGACY_BACKUP_DIR, os.path.basename(path)))
+    print(f"Migrated legacy state into {len(owned)} guild partitions; originals kept in {LEGACY_BACKUP_DIR}.")
+    if unresolved:
+        print(f"⚠️ {len(unresolved)} legacy state entries point at channels that no longer exist; "
+              f"they were not migrated and remain in {LEGACY_BACKUP_DIR}.")
+    return 0
+
+def load_state():
+    if PROCESS.loaded:
+        return
+    PARTITIONS.scan_on_ready = not os.path.exists(PROCESS.files["wakeups"])
+    PROCESS.load()
+
+class AdmissionBucket:
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=ADMISSION_QUEUE_LIMIT)
+        self.workers = 0
+        self.avg_seconds = 2.0
+
+    def record(self, seconds: float):
+        self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * seconds
+
+class AdmissionScheduler:
+    def __init__(self):
+        self._buckets = {}
+        self._guild_slots = {}
+        self._queued_users = set()
+        self._reserved = {}
+        self._tasks = set()
+
+    async def submit(self, interaction: discord.Interaction, job) -> Optional[str]:
+        user_key = (interaction.guild_id, interaction.user.id)
+        if user_key in self._queued_users:
+            return "⏳ طلبك في الطابور بالفعل."
+        key = (interaction.guild_id, job.category_id)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = AdmissionBucket()
+        position = bucket.queue.qsize() + bucket.workers
+        try:
+            bucket.queue.put_nowait((interaction, job))
+        except asyncio.QueueFull:
+            return "❌ الضغط عالٍ حاليًا، حاول مرة أخرى بعد قليل."
+        self._queued_users.add(user_key)
+        if bucket.workers < ADMISSION_CONCURRENCY:
+            bucket.workers += 1
+            task = asyncio.create_task(self._drain(key, bucket))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if position >= ADMISSION_CONCURRENCY:
+            ahead = position - ADMISSION_CONCURRENCY + 1
+            eta = int(ahead * bucket.avg_seconds / ADMISSION_CONCURRENCY) + 1
+            return f"⏳ أنت رقم {ahead} في الطابور. الوقت المتوقع ~{eta} ث."
+        return None
+
+    async def _drain(self, key, bucket: AdmissionBucket):
+        slots = self._guild_slots.get(key[0])
+        if slots is None:
+            slots = self._guild_slots[key[0]] = asyncio.Semaphore(GUILD_CREATE_CONCURRENCY)
+        try:
+            while not bucket.queue.empty():
+                interaction, job = bucket.queue.get_nowait()
+                start = time.monotonic()
+                try:
+                    async with slots:
+                        await job.open_ticket(interaction)
+                except Exception as e:
+                    print("Ticket open error:", e)
+                    with contextlib.suppress(discord.HTTPException):
+                        await interaction.followup.send("❌ تعذر فتح التذكرة، حاول مرة أخرى.", ephemeral=True)
+                finally:
+                    self._queued_users.discard((interaction.guild_id, interaction.user.id))
+                    bucket.record(time.monotonic() - start)
+        finally:
+            bucket.workers -= 1
+            if not bucket.workers and bucket.queue.empty():
+                self._buckets.pop(key, None)
+
+    def reserve_category(self, guild: discord.Guild, primary: discord.CategoryChannel) -> Optional[discord.CategoryChannel]:
+        siblings = [c for c in guild.categories if c.name == primary.name and c.id != primary.id]
+        for cat in [primary] + siblings:
+            if len(cat.channels) + self._reserved.get(cat.id, 0) < CATEGORY_CHANNEL_LIMIT:
+                self._reserved[cat.id] = self._reserved.get(cat.id, 0) + 1
+                return cat
+        return None
+
+    def release_category(self, category_id: int):
+        left = self._reserved.get(category_id, 0) - 1
+        if left > 0:
+            self._reserved[category_id] = left
+        else:
+            self._reserved.pop(category_id, None)
+
+    def busy(self, guild_id: int) -> bool:
+        return any(key[0] == guild_id for key in self._buckets)
+
+ADMISSION = AdmissionScheduler()
+
+POOL_CHANNEL_NAME = "ticket-pool"
+POOL_REFILL_INTERVAL = 2.0
+POOL_IDLE_CHECK = 60.0
+
+class ChannelPool:
+    def __init__(self):
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def size(self, state: GuildState) -> int:
+        return int(state.get("config").get("channel_pool_size") or 0)
+
+    def categories(self, state: GuildState) -> set:
+        return {int(b["category_id"]) for btns in state.get("buttons").values() for b in btns}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._refill_loop())
+
+    def attach(self, state: GuildState):
+        if BOT.is_ready() and self.size(state) > 0:
+            self.reconcile(state)
+            self._wake.set()
+
+    def reconcile(self, state: GuildState):
+        pool = state.get("pool")
+        tickets = state.get("tickets")
+        for key in set(pool) | {str(c) for c in self.categories(state)}:
+            ids = pool.get(key, [])
+            live = [cid for cid in ids if isinstance(BOT.get_channel(cid), discord.TextChannel) and str(cid) not in tickets]
+            cat = BOT.get_channel(int(key))
+            if isinstance(cat, discord.CategoryChannel):
+                known = set(live)
+                live += [c.id for c in cat.text_channels
+                         if c.name == POOL_CHANNEL_NAME and c.id not in known and str(c.id) not in tickets]
+            if live != ids:
+                state.set("pool", [key], live)
+
+    async def claim(self, state: GuildState, category: discord.CategoryChannel, name: str,
+                    overwrites: dict) -> Optional[discord.TextChannel]:
+        if self.size(state) <= 0:
+            return None
+        key = str(category.id)
+        ids = list(state.get("pool").get(key, []))
+        try:
+            while ids:
+                channel = category.guild.get_channel(ids.pop(0))
+                state.set("pool", [key], ids)
+                if not isinstance(channel, discord.TextChannel):
+                    continue
+                try:
+                    await channel.edit(name=name, overwrites=overwrites, reason="فتح تذكرة جديدة")
+                except discord.NotFound:
+                    continue
+                except discord.HTTPException as e:
+                    print("Pool claim error:", e)
+                    state.set("pool", [key], state.get("pool").get(key, []) + [channel.id])
+                    return None
+                return channel
+            return None
+        finally:
+            self._wake.set()
+
+    async def _refill_loop(self):
+        await BOT.wait_until_ready()
+        for state in PARTITIONS.loaded():
+            if self.size(state) > 0:
+                self.reconcile(state)
+        while True:
+            try:
+                created = await self._refill_one()
+            except Exception as e:
+                print("Pool refill error:", e)
+                created = False
+            if created:
+                await asyncio.sleep(POOL_REFILL_INTERVAL)
+                continue
+            self._wake.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), POOL_IDLE_CHECK)
 
-def load_json(name: str):
-    with open(FILES[name], "r", encoding="utf-8") as f:
-        return json.load(f)
+    async def _refill_one(self) -> bool:
+        for state in PARTITIONS.loaded():
+            size = self.size(state)
+            if size <= 0 or ADMISSION.busy(state.guild_id):
+                continue
+            for cat_id in self.categories(state):
+                ids = state.get("pool").get(str(cat_id), [])
+                cat = BOT.get_channel(cat_id)
+                if len(ids) >= size or not isinstance(cat, discord.CategoryChannel):
+                    continue
+                if len(cat.channels) >= CATEGORY_CHANNEL_LIMIT - 1:
+                    continue
+                guild = cat.guild
+                overwrites = dict(cat.overwrites)
+                overwrites[guild.default_role] = discord.PermissionOverwrite(view_channel=False)
+                overwrites[guild.me] = discord.PermissionOverwrite(view_channel=True, read_messages=True, send_messages=True)
+                channel = await guild.create_text_channel(POOL_CHANNEL_NAME, category=cat, overwrites=overwrites, reason="تجهيز قناة تذكرة مسبقًا")
+                state.set("pool", [cat_id], state.get("pool").get(str(cat_id), []) + [channel.id])
+                return True
+        return False
 
-def save_json(name: str, data):
-    with open(FILES[name], "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+CHANNEL_POOL = ChannelPool()
 
 def style_from_text(txt: str) -> discord.ButtonStyle:
     return COLOR_TO_STYLE.get(txt.lower(), discord.ButtonStyle.secondary)
 
+def single_flight(op: Optional[str] = None, *params: str):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            interaction = args[-1]
+            values = tuple(getattr(kwargs.get(p), "id", kwargs.get(p)) for p in params)
+            key = (op or args[0].custom_id, interaction.channel_id, interaction.user.id) + values
+            if not IN_FLIGHT.claim(key):
+                return await interaction.response.send_message("⏳ طلبك قيد التنفيذ بالفعل.", ephemeral=True)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                IN_FLIGHT.release(key)
+        return wrapper
+    return decorator
+
+def get_open_ticket(state: GuildState, channel_id: int) -> Optional[dict]:
+    if channel_id in CLOSING_TICKETS:
+        return None
+    return state.get("tickets").get(str(channel_id))
+
+TRANSCRIPT_BATCH = 100
+
+def transcript_record(message: discord.Message) -> dict:
+    return {
+        "id": message.id,
+        "author_id": message.author.id,
+        "author": str(message.author),
+        "created_at": message.created_at.isoformat(),
+        "content": message.content,
+        "embeds": [e.to_dict() for e in message.embeds],
+        "attachments": [a.url for a in message.attachments],
+    }
+
+TRANSCRIPT_SUFFIXES = {"jsonl": ".jsonl.gz", "html": ".html.gz", "attachments": ".attachments.txt"}
+
+def transcript_dir(guild_id: int) -> str:
+    return os.path.join(guild_dir(guild_id), "transcripts")
+
+def transcript_files(guild_id: int, channel_id: int) -> dict:
+    base = os.path.join(transcript_dir(guild_id), str(channel_id))
+    return {kind: base + suffix for kind, suffix in TRANSCRIPT_SUFFIXES.items()}
+
+def find_transcript(guild_id: int, channel_id: int) -> Optional[dict]:
+    found = None
+    path = os.path.join(transcript_dir(guild_id), "index.jsonl")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            with contextlib.suppress(ValueError):
+                entry = json.loads(line)
+                if entry.get("channel_id") == channel_id:
+                    found = entry
+    return found
+
+class TranscriptArchive:
+    def __init__(self, channel: discord.TextChannel, with_html: bool, with_attachments: bool):
+        self.directory = transcript_dir(channel.guild.id)
+        self.index_path = os.path.join(self.directory, "index.jsonl")
+        self.title = channel.name
+        paths = transcript_files(channel.guild.id, channel.id)
+        self.targets = {"jsonl": paths["jsonl"]}
+        if with_html:
+            self.targets["html"] = paths["html"]
+        if with_attachments:
+            self.targets["attachments"] = paths["attachments"]
+        self.messages = 0
+        self._files = {}
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for kind, path in self.targets.items():
+            opener = gzip.open if path.endswith(".gz") else open
+            self._files[kind] = opener(path + ".tmp", "wt", encoding="utf-8")
+        if "html" in self._files:
+            self._files["html"].write(f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{html.escape(self.title)}</title></head><body>\n')
+
+    def write(self, records: list):
+        for rec in records:
+            self._files["jsonl"].write(json.dumps(rec, ensure_ascii=False) + "\n")
+            if "html" in self._files:
+                links = "".join(f'<br><a href="{html.escape(url)}">{html.escape(url)}</a>' for url in rec["attachments"])
+                self._files["html"].write(
+                    f'<p><b>{html.escape(rec["author"])}</b> <small>{rec["created_at"]}</small><br>'
+                    f'{html.escape(rec["content"])}{links}</p>\n'
+                )
+            if "attachments" in self._files:
+                for url in rec["attachments"]:
+                    self._files["attachments"].write(f"{rec['id']}\t{url}\n")
+        self.messages += len(records)
+
+    def close(self) -> int:
+        if "html" in self._files:
+            self._files["html"].write("</body></html>\n")
+        size = 0
+        for kind, f in self._files.items():
+            f.close()
+            os.replace(self.targets[kind] + ".tmp", self.targets[kind])
+            size += os.path.getsize(self.targets[kind])
+        self._files.clear()
+        return size
+
+    def record(self, entry: dict):
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def discard(self):
+        for kind, f in self._files.items():
+            f.close()
+            with contextlib.suppress(OSError):
+                os.remove(self.targets[kind] + ".tmp")
+        self._files.clear()
+
+async def archive_transcript(state: GuildState, channel: discord.TextChannel) -> Optional[dict]:
+    opts = state.get("config").get("transcripts", {})
+    if not opts.get("enabled", True):
+        return None
+    archive = TranscriptArchive(channel, opts.get("html", False), opts.get("attachments", True))
+    start = time.perf_counter()
+    await asyncio.to_thread(archive.open)
+    try:
+        batch = []
+        async for message in channel.history(limit=None, oldest_first=True):
+            batch.append(transcript_record(message))
+            if len(batch) >= TRANSCRIPT_BATCH:
+                await asyncio.to_thread(archive.write, batch)
+                batch = []
+        if batch:
+            await asyncio.to_thread(archive.write, batch)
+        size = await asyncio.to_thread(archive.close)
+    except BaseException:
+        await asyncio.to_thread(archive.discard)
+        raise
+    elapsed = time.perf_counter() - start
+    entry = {
+        "channel_id": channel.id,
+        "files": archive.targets,
+        "messages": archive.messages,
+        "bytes": size,
+        "seconds": round(elapsed, 3),
+        "closed_at": int(time.time()),
+    }
+    await asyncio.to_thread(archive.record, entry)
+    rate = archive.messages / elapsed if elapsed else 0.0
+    print(f"Archived ticket {channel.id}: {archive.messages} messages, {size} bytes in {elapsed:.2f}s ({rate:.0f} msg/s).")
+    return entry
+
+DELETE_BATCH = 5
+DELETE_INTERVAL = 1.0
+DELETE_RETRY_BASE = 5.0
+DELETE_RETRY_MAX = 600.0
+ACTIVITY_GRANULARITY = 60.0
+
+async def archive_ticket(state: GuildState, channel_id: int, channel: Optional[discord.TextChannel]) -> bool:
+    info = state.get("tickets").get(str(channel_id))
+    if channel is None or (info and info.get("archived_at")):
+        return True
+    try:
+        await archive_transcript(state, channel)
+    except Exception as e:
+        print("Transcript error:", e)
+        with contextlib.suppress(discord.HTTPException):
+            await channel.send("⚠️ تعذر حفظ نسخة من التذكرة، لم يتم حذف القناة.")
+        return False
+    if str(channel_id) in state.get("tickets"):
+        state.set("tickets", [channel_id, "archived_at"], time.time())
+    return True
+
+async def finish_close(state: GuildState, channel_id: int, channel: Optional[discord.TextChannel]):
+    if channel is not None:
+        try:
+            await channel.delete(reason="إغلاق التذكرة")
+        except discord.NotFound:
+            pass
+        except Exception as e:
+            LIFECYCLE.retry_delete(state, channel_id, e)
+            return
+    async with TICKET_LOCKS.hold(channel_id):
+        info = state.get("tickets").get(str(channel_id))
+        if info is not None:
+            STATS.closed(state, info)
+        state.delete("tickets", [channel_id])
+        state.owners.remove(channel_id)
+        PERMISSIONS.forget(channel_id)
+    LIFECYCLE.finish_delete(state, channel_id)
+
+class LifecycleScheduler:
+    def __init__(self):
+        self.resolve_channel = BOT.get_channel
+        self._heap = []
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._started_at = time.time()
+        self._attempts = {}
+        self._archiving = {}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._start_when_ready())
+            self._task.add_done_callback(report_stopped("Lifecycle scheduler"))
+
+    async def _start_when_ready(self):
+        await BOT.wait_until_ready()
+        await self.run()
+
+    def rebuild(self):
+        self._heap = [(due, int(gid), 0, "wake") for gid, due in PROCESS.get("wakeups").items()]
+        for state in PARTITIONS.loaded():
+            self._heap.extend(self._timers(state))
+        heapq.heapify(self._heap)
+
+    def _timers(self, state: GuildState) -> list:
+        timers = [(due, state.guild_id, int(cid), "delete") for cid, due in state.get("lifecycle")["deletions"].items()]
+        for cid, info in state.get("tickets").items():
+            due = self._idle_due(state, info)
+            if due is not None:
+                timers.append((due, state.guild_id, int(cid), "idle"))
+        return timers
+
+    def attach(self, state: GuildState):
+        for entry in self._timers(state):
+            heapq.heappush(self._heap, entry)
+        self._wake.set()
+
+    def detach(self, state: GuildState):
+        due = min((entry[0] for entry in self._timers(state)), default=None)
+        key = str(state.guild_id)
+        if due is not None:
+            PROCESS.set("wakeups", [key], due)
+            heapq.heappush(self._heap, (due, state.guild_id, 0, "wake"))
+            self._wake.set()
+        elif key in PROCESS.get("wakeups"):
+            PROCESS.delete("wakeups", [key])
+
+    def schedule_delete(self, state: GuildState, channel_id: int, delay: float):
+        now = time.time()
+        due = now + delay
+        info = state.get("tickets").get(str(channel_id))
+        if info is not None and not info.get("closed_at"):
+            state.set("tickets", [channel_id, "closed_at"], now)
+        state.set("lifecycle", ["deletions", channel_id], due)
+        self._push(due, state.guild_id, channel_id, "delete")
+
+    def retry_delete(self, state: GuildState, channel_id: int, error: Exception):
+        attempt = self._attempts.get(channel_id, 0) + 1
+        self._attempts[channel_id] = attempt
+        delay = min(DELETE_RETRY_MAX, DELETE_RETRY_BASE * 2 ** (attempt - 1))
+        METRICS.inc("ticket_delete_retries_total")
+        print(f"Ticket {channel_id} delete failed ({error}), retrying in {delay:.0f}s.")
+        self.schedule_delete(state, channel_id, delay)
+
+    def finish_delete(self, state: GuildState, channel_id: int):
+        self._attempts.pop(channel_id, None)
+        info = state.get("tickets").get(str(channel_id))
+        if info is not None and info.get("closed_at"):
+            state.delete("tickets", [channel_id, "closed_at"])
+        state.delete("lifecycle", ["deletions", channel_id])
+        CLOSING_TICKETS.discard(channel_id)
+
+    def track(self, state: GuildState, channel_id: int):
+        info = state.get("tickets").get(str(channel_id))
+        due = self._idle_due(state, info) if info else None
+        if due is not None:
+            self._push(due, state.guild_id, channel_id, "idle")
+
+    def touch(self, state: GuildState, channel_id: int):
+        info = state.get("tickets").get(str(channel_id))
+        if not info or channel_id in CLOSING_TICKETS:
+            return
+        now = time.time()
+        if info.get("warned"):
+            state.set("tickets", [channel_id, "warned"], False)
+        elif now - (info.get("last_activity") or 0) < ACTIVITY_GRANULARITY:
+            return
+        state.set("tickets", [channel_id, "last_activity"], now)
+
+    def wants_activity(self, guild_id: int) -> bool:
+        return str(guild_id) in PROCESS.get("wakeups")
+
+    def _push(self, due: float, guild_id: int, channel_id: int, kind: str):
+        heapq.heappush(self._heap, (due, guild_id, channel_id, kind))
+        earliest = PROCESS.get("wakeups").get(str(guild_id))
+        if earliest is None or due < earliest:
+            PROCESS.set("wakeups", [guild_id], due)
+        self._wake.set()
+
+    def _idle_due(self, state: GuildState, info: dict) -> Optional[float]:
+        opts = state.get("config").get("inactivity", {})
+        warn = float(opts.get("warn_hours") or 0) * 3600
+        close = float(opts.get("close_hours") or 0) * 3600
+        last = info.get("last_activity") or self._started_at
+        if info.get("warned") or not warn:
+            return last + close if close else None
+        return last + warn
+
+    async def run(self):
+        self.rebuild()
+        while True:
+            self._wake.clear()
+            now = time.time()
+            deletions = {}
+            while self._heap and self._heap[0][0] <= now and len(deletions) < DELETE_BATCH:
+                due, guild_id, channel_id, kind = heapq.heappop(self._heap)
+                try:
+                    if kind == "wake":
+                        await self._wake_guild(guild_id)
+                        continue
+                    state = PARTITIONS.peek(guild_id)
+                    if state is None:
+                        continue
+                    if kind in ("delete", "purge"):
+                        if state.get("lifecycle")["deletions"].get(str(channel_id)) is None:
+                            continue
+                        if kind == "purge":
+                            deletions[channel_id] = state
+                        elif channel_id not in self._archiving:
+                            task = asyncio.create_task(self._archive(state, channel_id))
+                            self._archiving[channel_id] = task
+                            task.add_done_callback(lambda _, cid=channel_id: self._archiving.pop(cid, None))
+                    else:
+                        await self._check_idle(state, channel_id, now)
+                except Exception as e:
+                    METRICS.inc("lifecycle_errors_total", kind=kind)
+                    print(f"Lifecycle {kind} error for {channel_id}:", e)
+            if deletions:
+                await asyncio.gather(*(finish_close(state, cid, self.resolve_channel(cid)) for cid, state in deletions.items()),
+                                     return_exceptions=True)
+                await asyncio.sleep(DELETE_INTERVAL)
+                continue
+            timeout = self._heap[0][0] - now if self._heap else None
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wake.wait(), timeout)
+
+    async def _archive(self, state: GuildState, channel_id: int):
+        try:
+            archived = await archive_ticket(state, channel_id, self.resolve_channel(channel_id))
+        except Exception as e:
+            print("Ticket archive error:", e)
+            archived = False
+        if archived:
+            self._push(time.time(), state.guild_id, channel_id, "purge")
+        else:
+            self.finish_delete(state, channel_id)
+
+    async def _wake_guild(self, guild_id: int):
+        if PARTITIONS.peek(guild_id) is not None:
+            return
+        if BOT.get_guild(guild_id) is None:
+            PROCESS.delete("wakeups", [guild_id])
+            return
+        try:
+            await PARTITIONS.get(guild_id)
+        except Exception as e:
+            print("Partition load error:", e)
+
+    async def _check_idle(self, state: GuildState, channel_id: int, now: float):
+        info = get_open_ticket(state, channel_id)
+        due = self._idle_due(state, info) if info else None
+        if due is None:
+            return
+        if due > now:
+            heapq.heappush(self._heap, (due, state.guild_id, channel_id, "idle"))
+            return
+        channel = self.resolve_channel(channel_id)
+        opts = state.get("config").get("inactivity", {})
+        if not info.get("warned") and opts.get("warn_hours"):
+            state.set("tickets", [channel_id, "warned"], True)
+            self.track(state, channel_id)
+            if channel is not None:
+                close_hours = opts.get("close_hours")
+                notice = f"⏰ <@{info['owner_id']}> هذه التذكرة غير نشطة."
+                if close_hours:
+                    notice += f" سيتم إغلاقها تلقائيًا بعد {close_hours} ساعة إذا لم يتم الرد."
+                with contextlib.suppress(discord.HTTPException):
+                    await channel.send(notice)
+            return
+        CLOSING_TICKETS.add(channel_id)
+        if channel is not None:
+            with contextlib.suppress(discord.HTTPException):
+                await channel.send("🔒 تم إغلاق التذكرة تلقائيًا لعدم النشاط.")
+        state = await PARTITIONS.get(state.guild_id)
+        self.schedule_delete(state, channel_id, 0)
+
+LIFECYCLE = LifecycleScheduler()
+
 def can_use_admin_commands(interaction: discord.Interaction, ticket_info: dict) -> bool:
     if interaction.user.guild_permissions.manage_channels:
         return True
@@ -78,44 +1439,363 @@ def can_use_admin_commands(interaction: discord.Interaction, ticket_info: dict)
         return True
     return False
 
+PERMISSION_BATCH_DELAY = 0.5
+PERMISSION_OVERLAY_TTL = 30.0
+
+def ticket_permission_changes(guild: discord.Guild,
+                              owner: Optional[discord.Member],
+                              handler: Optional[discord.Member],
+                              write_role: Optional[discord.Role],
+                              locked: bool,
+                              previous_handler_id: Optional[int] = None) -> dict:
+    changes = {guild.default_role: discord.PermissionOverwrite(send_messages=not locked, read_messages=True, view_channel=True)}
+    for target in (owner, handler, write_role):
+        if target is not None:
+            changes[target] = discord.PermissionOverwrite(send_messages=True, read_messages=True, view_channel=True)
+    keep = {t.id for t in (owner, handler) if t is not None}
+    if previous_handler_id and previous_handler_id not in keep:
+        changes[discord.Object(id=previous_handler_id)] = None
+    return changes
+
+def ticket_overwrites(base: dict,
+                      guild: discord.Guild,
+                      owner: discord.Member,
+                      handler: Optional[discord.Member],
+                      write_role: Optional[discord.Role],
+                      locked: bool) -> dict:
+    overwrites = dict(base)
+    overwrites.update(ticket_permission_changes(guild, owner, handler, write_role, locked))
+    return overwrites
+
+class PermissionBatcher:
+    def __init__(self):
+        self._pending = {}
+        self._applied = {}
+        self._tasks = set()
+
+    def update(self, channel: discord.TextChannel, changes: dict):
+        entry = self._pending.get(channel.id)
+        if entry is None:
+            entry = self._pending[channel.id] = (channel, {})
+            task = asyncio.create_task(self._flush_later(channel.id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        for target, overwrite in changes.items():
+            entry[1].pop(target.id, None)
+            entry[1][target.id] = (target, overwrite)
+
+    async def drain(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def _flush_later(self, channel_id: int):
+        await asyncio.sleep(PERMISSION_BATCH_DELAY)
+        channel, changes = self._pending.pop(channel_id)
+        for attempt in range(2):
+            try:
+                async with TICKET_LOCKS.hold(channel_id):
+                    await self.flush(channel, changes)
+                return
+            except discord.NotFound:
+                self._applied.pop(channel_id, None)
+                return
+            except Exception as e:
+                self._applied.pop(channel_id, None)
+                METRICS.inc("permission_updates_total", result="error")
+                print(f"Permission update error (attempt {attempt + 1}):", e)
+        with contextlib.suppress(discord.HTTPException):
+            await channel.send("⚠️ تعذر تحديث صلاحيات التذكرة، يرجى مراجعتها يدويًا.")
+
+    def _current(self, channel: discord.TextChannel) -> dict:
+        applied = self._applied.get(channel.id)
+        if applied and time.monotonic() - applied[0] < PERMISSION_OVERLAY_TTL:
+            return dict(applied[1])
+        return {target.id: (target, overwrite) for target, overwrite in channel.overwrites.items()}
+
+    async def flush(self, channel: discord.TextChannel, changes: dict):
+        current = self._current(channel)
+        diff = {}
+        for target_id, (target, overwrite) in changes.items():
+            existing = current.get(target_id)
+            if overwrite is None:
+                if existing is not None:
+                    diff[target_id] = (existing[0], None)
+            elif existing is None or existing[1] != overwrite:
+                diff[target_id] = (target, overwrite)
+        if not diff:
+            METRICS.inc("permission_updates_total", result="skipped")
+            return
+        current.update(diff)
+        after = {tid: entry for tid, entry in current.items() if entry[1] is not None}
+        target, overwrite = next(iter(diff.values()))
+        if len(diff) == 1 and isinstance(target, (discord.abc.User, discord.Role)):
+            METRICS.inc("permission_updates_total", result="single")
+            await channel.set_permissions(target, overwrite=overwrite, reason="Ticket permissions update")
+        else:
+            METRICS.inc("permission_updates_total", result="full")
+            await channel.edit(overwrites=dict(after.values()), reason="Ticket permissions update")
+        self._applied[channel.id] = (time.monotonic(), after)
+
+    def forget(self, channel_id: int):
+        self._applied.pop(channel_id, None)
+
+PERMISSIONS = PermissionBatcher()
+
 async def set_ticket_permissions(channel: discord.TextChannel,
-                                 owner: discord.Member,
+                                 owner: Optional[discord.Member],
                                  handler: Optional[discord.Member],
                                  write_role: Optional[discord.Role],
-                                 locked: bool):
-    overwrites = channel.overwrites
-    guild = channel.guild
-    overwrites[guild.default_role] = discord.PermissionOverwrite(send_messages=not locked, read_messages=True, view_channel=True)
-    overwrites[owner] = discord.PermissionOverwrite(send_messages=True, read_messages=True, view_channel=True)
-    if handler:
-        overwrites[handler] = discord.PermissionOverwrite(send_messages=True, read_messages=True, view_channel=True)
-    if write_role:
-        overwrites[write_role] = discord.PermissionOverwrite(send_messages=True, read_messages=True, view_channel=True)
-    await channel.edit(overwrites=overwrites, reason="Ticket permissions update")
-
-class OpenTicketButton(discord.ui.Button):
-    def __init__(self, label: str, style_text: str, category_id: int):
-        super().__init__(label=label, style=style_from_text(style_text), custom_id=f"open_ticket:{category_id}:{label}")
+                                 locked: bool,
+                                 previous_handler_id: Optional[int] = None):
+    changes = ticket_permission_changes(channel.guild, owner, handler, write_role, locked, previous_handler_id)
+    PERMISSIONS.update(channel, changes)
+
+PANEL_RENDER_VERSION = 1
+RENDER_RATE = 4.0
+RENDER_REPORT_EVERY = 25
+RENDER_REPORT_TTL = 840.0
+
+class BulkRenderer:
+    def __init__(self):
+        self._jobs = {}
+        self._reporters = {}
+        self._next_slot = 0.0
+
+    def busy(self, guild_id: int) -> bool:
+        return guild_id in self._jobs
+
+    def register_panel(self, state: GuildState, message: discord.Message, version: int = PANEL_RENDER_VERSION):
+        key = str(message.id)
+        if key in state.get("buttons") and key not in state.get("panels"):
+            state.set("panels", [key], {"channel_id": message.channel.id, "version": version})
+
+    def partial_message(self, state: GuildState, channel_id: int, message_id: int) -> discord.PartialMessage:
+        channel = BOT.get_partial_messageable(channel_id, guild_id=state.guild_id, type=discord.ChannelType.text)
+        return channel.get_partial_message(message_id)
+
+    def stale(self, state: GuildState, skip: set = frozenset()) -> list:
+        work = [("panel", key) for key, panel in state.get("panels").items()
+                if panel.get("version", 0) < PANEL_RENDER_VERSION and ("panel", key) not in skip]
+        version = state.get("config").get("controls_version", 0)
+        work += [("controls", cid) for cid, info in state.get("tickets").items()
+                 if info.get("controls_id") and info.get("controls_version", 0) < version
+                 and int(cid) not in CLOSING_TICKETS and ("controls", cid) not in skip]
+        return work
+
+    def schedule(self, state: GuildState, interaction: Optional[discord.Interaction] = None) -> int:
+        if interaction is not None:
+            self._reporters[state.guild_id] = (interaction, time.monotonic())
+        pending = len(self.stale(state))
+        if pending and state.guild_id not in self._jobs:
+            task = asyncio.create_task(self._run(state))
+            self._jobs[state.guild_id] = task
+            task.add_done_callback(lambda _: self._jobs.pop(state.guild_id, None))
+        return pending
+
+    async def _pace(self, guild_id: int):
+        while ADMISSION.busy(guild_id):
+            await asyncio.sleep(1.0)
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + 1 / RENDER_RATE
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _run(self, state: GuildState):
+        await BOT.wait_until_ready()
+        done = failed = 0
+        skip = set()
+        start = time.perf_counter()
+        while True:
+            work = self.stale(state, skip)
+            if not work:
+                break
+            total = done + failed + len(work)
+            for item in work:
+                await self._pace(state.guild_id)
+                try:
+                    await self._render(state, *item)
+                    done += 1
+                    METRICS.inc("render_edits_total", kind=item[0], result="ok")
+                except discord.HTTPException as e:
+                    failed += 1
+                    skip.add(item)
+                    METRICS.inc("render_edits_total", kind=item[0], result="error")
+                    print(f"Render error ({item[0]} {item[1]}):", e)
+                if (done + failed) % RENDER_REPORT_EVERY == 0:
+                    await self._report(state.guild_id, f"🔄 جارٍ تحديث الرسائل: {done + failed}/{total}")
+        elapsed = time.perf_counter() - start
+        print(f"Re-rendered {done} messages for guild {state.guild_id} in {elapsed:.1f}s ({failed} failed).")
+        await self._report(state.guild_id, f"✅ تم تحديث {done} رسالة" + (f"، وتعذر تحديث {failed}." if failed else "."))
+        self._reporters.pop(state.guild_id, None)
+
+    async def _render(self, state: GuildState, kind: str, key: str):
+        if kind == "panel":
+            panel = state.get("panels").get(key)
+            btns = state.get("buttons").get(key)
+            if panel is None:
+                return
+            if not btns:
+                state.delete("panels", [key])
+                return
+            try:
+                await self.partial_message(state, panel["channel_id"], int(key)).edit(view=panel_view(btns))
+            except discord.NotFound:
+                state.delete("panels", [key])
+                return
+            state.set("panels", [key, "version"], PANEL_RENDER_VERSION)
+            return
+        config = state.get("config")
+        version = config.get("controls_version", 0)
+        info = get_open_ticket(state, int(key))
+        if not info or not info.get("controls_id"):
+            return
+        async with TICKET_LOCKS.hold(int(key)):
+            try:
+                await self.partial_message(state, int(key), info["controls_id"]).edit(view=InTicketControlsView(config))
+            except discord.NotFound:
+                pass
+            if get_open_ticket(state, int(key)) is not None:
+                state.set("tickets", [key, "controls_version"], version)
+
+    async def _report(self, guild_id: int, text: str):
+        reporter = self._reporters.get(guild_id)
+        if reporter is None:
+            return
+        interaction, since = reporter
+        if time.monotonic() - since > RENDER_REPORT_TTL:
+            self._reporters.pop(guild_id, None)
+            return
+        with contextlib.suppress(discord.HTTPException):
+            await interaction.edit_original_response(content=text)
+
+RENDERER = BulkRenderer()
+
+MEMBER_CACHE_SIZE = 5000
+MEMBER_CACHE_TTL = 600.0
+
+class MemberResolver:
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self._cache = collections.OrderedDict()
+        self._inflight = {}
+
+    def remember(self, member: discord.Member):
+        guild = getattr(member, "guild", None)
+        if guild is not None:
+            self._store((guild.id, member.id), member)
+
+    def _store(self, key: tuple, member: Optional[discord.Member]):
+        self._cache[key] = (time.monotonic() + self.ttl, member)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.size:
+            self._cache.popitem(last=False)
+
+    async def resolve(self, guild: discord.Guild, user_id: int) -> Optional[discord.Member]:
+        member = guild.get_member(user_id)
+        if member is not None:
+            METRICS.inc("member_lookups_total", source="gateway")
+            return member
+        key = (guild.id, user_id)
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._cache.move_to_end(key)
+            METRICS.inc("member_lookups_total", source="lru")
+            return entry[1]
+        future = self._inflight.get(key)
+        if future is None:
+            future = self._inflight[key] = asyncio.ensure_future(self._fetch(guild, user_id))
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+            METRICS.inc("member_lookups_total", source="rest")
+        else:
+            METRICS.inc("member_lookups_total", source="coalesced")
+        return await asyncio.shield(future)
+
+    async def _fetch(self, guild: discord.Guild, user_id: int) -> Optional[discord.Member]:
+        try:
+            member = await guild.fetch_member(user_id)
+        except discord.NotFound:
+            member = None
+        except discord.HTTPException as e:
+            print("Member lookup error:", e)
+            return None
+        self._store((guild.id, user_id), member)
+        return member
+
+MEMBERS = MemberResolver(MEMBER_CACHE_SIZE, MEMBER_CACHE_TTL)
+
+class OpenTicketButton(discord.ui.DynamicItem[discord.ui.Button], template=r"ticket:open:(?P<category_id>[0-9]+):(?P<slot>[0-9]+)"):
+    def __init__(self, label: str, style: discord.ButtonStyle, category_id: int, slot: int = 0,
+                 custom_id: Optional[str] = None):
+        super().__init__(discord.ui.Button(label=label, style=style, custom_id=custom_id or f"ticket:open:{category_id}:{slot}"))
         self.category_id = category_id
-        self.style_text = style_text
+        self.slot = slot
+
+    panel_version = PANEL_RENDER_VERSION
+
+    @property
+    def label(self) -> str:
+        return self.item.label or ""
 
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(item.label, item.style, int(match["category_id"]), int(match["slot"]))
+
+    @instrumented("open_ticket")
+    @single_flight()
     async def callback(self, interaction: discord.Interaction):
         await interaction.response.defer(ephemeral=True, thinking=False)
-        config = load_json("config")
+        state = await PARTITIONS.get(interaction.guild_id)
+        if interaction.message is not None:
+            RENDERER.register_panel(state, interaction.message, self.panel_version)
+        tickets = state.get("tickets")
+        existing = [cid for cid in state.owners.open_for(interaction.user.id)
+                    if tickets.get(str(cid), {}).get("category_id") == self.category_id]
+        if len(existing) >= MAX_TICKETS_PER_CATEGORY:
+            mentions = " ".join(f"<#{cid}>" for cid in existing)
+            return await interaction.followup.send(f"❌ لديك تذكرة مفتوحة بالفعل: {mentions}", ephemeral=True)
+        notice = await ADMISSION.submit(interaction, self)
+        if notice:
+            await interaction.followup.send(notice, ephemeral=True)
+
+    @instrumented("open_ticket.create")
+    async def open_ticket(self, interaction: discord.Interaction):
+        state = await PARTITIONS.get(interaction.guild_id)
+        config = state.get("config")
         mention_role_id = config.get("mention_role_id")
         write_role_id = config.get("write_role_id")
         write_role = interaction.guild.get_role(write_role_id) if write_role_id else None
-        cat = interaction.guild.get_channel(self.category_id)
-        if not isinstance(cat, discord.CategoryChannel):
+        primary = interaction.guild.get_channel(self.category_id)
+        if not isinstance(primary, discord.CategoryChannel):
             return await interaction.followup.send("❌ الكاتيجوري المحددة غير موجودة.", ephemeral=True)
         base_name = f"ticket-{interaction.user.name}".replace(" ", "-")
         name = base_name[:85]
-        channel = await interaction.guild.create_text_channel(name=name, category=cat, reason="فتح تذكرة جديدة")
-        tickets = load_json("tickets")
-        tickets[str(channel.id)] = {"owner_id": interaction.user.id, "handler_id": None}
-        save_json("tickets", tickets)
-        await set_ticket_permissions(channel, interaction.user, None, write_role, locked=False)
-        auto = load_json("categories").get(str(self.category_id), {}).get("auto_message")
+        overwrites = ticket_overwrites(primary.overwrites, interaction.guild, interaction.user, None, write_role, locked=False)
+        channel = await CHANNEL_POOL.claim(state, primary, name, overwrites)
+        if channel is None:
+            cat = ADMISSION.reserve_category(interaction.guild, primary)
+            if cat is None:
+                return await interaction.followup.send("❌ جميع الكاتيجوري ممتلئة حاليًا، حاول لاحقًا.", ephemeral=True)
+            overwrites = ticket_overwrites(cat.overwrites, interaction.guild, interaction.user, None, write_role, locked=False)
+            try:
+                channel = await interaction.guild.create_text_channel(name=name, category=cat, overwrites=overwrites, reason="فتح تذكرة جديدة")
+            finally:
+                ADMISSION.release_category(cat.id)
+        now = time.time()
+        state.set("tickets", [channel.id], {
+            "owner_id": interaction.user.id,
+            "handler_id": None,
+            "category_id": self.category_id,
+            "created_at": now,
+            "last_activity": now,
+            "controls_version": config.get("controls_version", 0),
+        })
+        state.owners.add(channel.id, interaction.user.id)
+        MEMBERS.remember(interaction.user)
+        STATS.opened(state, self.category_id)
+        LIFECYCLE.track(state, channel.id)
+        auto = state.get("categories").get(str(self.category_id), {}).get("auto_message")
         embed = discord.Embed(
             title="🎫 تذكرة جديدة",
             description=f"مرحبًا {interaction.user.mention}! تم فتح تذكرتك بنجاح.\nالغرض: **{self.label}**",
@@ -127,73 +1807,103 @@ class OpenTicketButton(discord.ui.Button):
                 embed.add_field(name="الرسالة التلقائية", value=auto["text"][:1024], inline=False)
             if auto.get("image"):
                 embed.set_image(url=auto["image"])
-        view = InTicketControlsView()
-        await channel.send(embed=embed, view=view)
-        if mention_role_id:
-            role = interaction.guild.get_role(mention_role_id)
-            if role:
-                try:
-                    await channel.send(role.mention)
-                except discord.Forbidden:
-                    pass
-        await interaction.followup.send(f"✅ تم فتح التذكرة: {channel.mention}", ephemeral=True)
+        view = InTicketControlsView(config)
+        role = interaction.guild.get_role(mention_role_id) if mention_role_id else None
+        welcome = channel.send(
+            content=role.mention if role else None,
+            embed=embed,
+            view=view,
+            allowed_mentions=discord.AllowedMentions(everyone=False, users=False, roles=[role] if role else False)
+        )
+        notice = interaction.followup.send(f"✅ تم فتح التذكرة: {channel.mention}", ephemeral=True)
+        message, sent = await asyncio.gather(welcome, notice, return_exceptions=True)
+        if isinstance(sent, Exception):
+            print("Ticket notice error:", sent)
+        if isinstance(message, Exception):
+            print("Welcome message error:", message)
+            try:
+                message = await channel.send(embed=embed, view=view)
+            except discord.HTTPException as e:
+                print("Welcome message retry error:", e)
+                return
+        if get_open_ticket(state, channel.id) is not None:
+            state.set("tickets", [channel.id, "controls_id"], message.id)
+
+class LegacyOpenTicketButton(OpenTicketButton, template=r"open_ticket:(?P<category_id>[0-9]+):(?P<label>.*)"):
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(item.label, item.style, int(match["category_id"]), custom_id=item.custom_id)
+
+    panel_version = 0
+
+    async def callback(self, interaction: discord.Interaction):
+        await super().callback(interaction)
+        RENDERER.schedule(await PARTITIONS.get(interaction.guild_id))
 
 class OpenButtonsView(discord.ui.View):
     def __init__(self, mapping: List[Tuple[str, str, int]], timeout=None):
         super().__init__(timeout=timeout)
-        for label, color, cat_id in mapping:
-            self.add_item(OpenTicketButton(label, color, cat_id))
+        for slot, (label, color, cat_id) in enumerate(mapping):
+            self.add_item(OpenTicketButton(label, style_from_text(color), cat_id, slot))
+
+def panel_view(btns: list) -> OpenButtonsView:
+    return OpenButtonsView([(b["label"], b["style"], int(b["category_id"])) for b in btns], timeout=None)
 
 class AcceptTicketButton(discord.ui.Button):
     def __init__(self):
         super().__init__(label=None, style=discord.ButtonStyle.success, custom_id="ticket_accept")
 
+    @instrumented("accept_ticket")
+    @single_flight()
     async def callback(self, interaction: discord.Interaction):
         channel = interaction.channel
-        tickets = load_json("tickets")
-        info = tickets.get(str(channel.id))
-        if not info:
-            return await interaction.response.send_message("❌ هذه القناة ليست تذكرة.", ephemeral=True)
-        if interaction.user.id == info["owner_id"]:
-            return await interaction.response.send_message("❌ لا يمكنك استلام هذه التذكرة لأنك صاحبها.", ephemeral=True)
-        config = load_json("config")
-        write_role_id = config.get("write_role_id")
-        write_role = interaction.guild.get_role(write_role_id) if write_role_id else None
-        owner = interaction.guild.get_member(info["owner_id"])
-        handler = interaction.user
-        info["handler_id"] = handler.id
-        save_json("tickets", tickets)
-        await set_ticket_permissions(channel, owner, handler, write_role, locked=True)
-        receipt = config.get("receipt_message") or "✅ تم الاستلام."
-        embed = discord.Embed(title="📩 تم استلام التذكرة", description=receipt, color=discord.Color.green())
-        await interaction.response.send_message(embed=embed)
+        state = await PARTITIONS.get(interaction.guild_id)
+        async with TICKET_LOCKS.hold(channel.id):
+            info = get_open_ticket(state, channel.id)
+            if not info:
+                return await interaction.response.send_message("❌ هذه القناة ليست تذكرة.", ephemeral=True)
+            if interaction.user.id == info["owner_id"]:
+                return await interaction.response.send_message("❌ لا يمكنك استلام هذه التذكرة لأنك صاحبها.", ephemeral=True)
+            if info.get("handler_id") == interaction.user.id:
+                return await interaction.response.send_message("ℹ️ لقد استلمت هذه التذكرة بالفعل.", ephemeral=True)
+            config = state.get("config")
+            write_role_id = config.get("write_role_id")
+            write_role = interaction.guild.get_role(write_role_id) if write_role_id else None
+            owner = await MEMBERS.resolve(interaction.guild, info["owner_id"])
+            handler = interaction.user
+            previous_handler_id = info.get("handler_id")
+            STATS.assigned(state, channel.id, info, handler.id)
+            state.set("tickets", [channel.id, "handler_id"], handler.id)
+            await set_ticket_permissions(channel, owner, handler, write_role, locked=True,
+                                         previous_handler_id=previous_handler_id)
+            receipt = config.get("receipt_message") or "✅ تم الاستلام."
+            embed = discord.Embed(title="📩 تم استلام التذكرة", description=receipt, color=discord.Color.green())
+            await interaction.response.send_message(embed=embed)
 
 class CloseTicketButton(discord.ui.Button):
     def __init__(self):
         super().__init__(label=None, style=discord.ButtonStyle.danger, custom_id="ticket_close")
 
+    @instrumented("close_ticket")
+    @single_flight("close")
     async def callback(self, interaction: discord.Interaction):
-        tickets = load_json("tickets")
-        info = tickets.get(str(interaction.channel.id))
-        if not info:
-            return await interaction.response.send_message("❌ هذه القناة ليست تذكرة.", ephemeral=True)
-        if interaction.user.id == info["owner_id"]:
-            return await interaction.response.send_message("❌ لا يمكنك إغلاق التذكرة. فقط المسؤول/المستلم.", ephemeral=True)
-        if not (interaction.user.guild_permissions.manage_channels or info.get("handler_id") == interaction.user.id):
-            return await interaction.response.send_message("❌ لا تملك صلاحية إغلاق هذه التذكرة.", ephemeral=True)
+        state = await PARTITIONS.get(interaction.guild_id)
+        async with TICKET_LOCKS.hold(interaction.channel.id):
+            info = get_open_ticket(state, interaction.channel.id)
+            if not info:
+                return await interaction.response.send_message("❌ هذه القناة ليست تذكرة.", ephemeral=True)
+            if interaction.user.id == info["owner_id"]:
+                return await interaction.response.send_message("❌ لا يمكنك إغلاق التذكرة. فقط المسؤول/المستلم.", ephemeral=True)
+            if not (interaction.user.guild_permissions.manage_channels or info.get("handler_id") == interaction.user.id):
+                return await interaction.response.send_message("❌ لا تملك صلاحية إغلاق هذه التذكرة.", ephemeral=True)
+            CLOSING_TICKETS.add(interaction.channel.id)
         await interaction.response.send_message("🗑️ سيتم إغلاق التذكرة خلال 3 ثوانٍ...")
-        await asyncio.sleep(3)
-        try:
-            del tickets[str(interaction.channel.id)]
-            save_json("tickets", tickets)
-        except KeyError:
-            pass
-        await interaction.channel.delete(reason="إغلاق التذكرة")
+        LIFECYCLE.schedule_delete(state, interaction.channel.id, 3)
 
 class InTicketControlsView(discord.ui.View):
-    def __init__(self):
+    def __init__(self, config: Optional[dict] = None):
         super().__init__(timeout=None)
-        cfg = load_json("config")
+        cfg = config or DEFAULTS["config"]
         close_label = cfg["in_ticket_buttons"]["close_label"]
         accept_label = cfg["in_ticket_buttons"]["accept_label"]
         accept_btn = AcceptTicketButton()
@@ -203,100 +1913,162 @@ class InTicketControlsView(discord.ui.View):
         self.add_item(accept_btn)
         self.add_item(close_btn)
 
-async def rebuild_persistent_views():
-    buttons = load_json("buttons")
-    for _, btns in buttons.items():
-        mapping = [(b["label"], b["style"], int(b["category_id"])) for b in btns]
-        BOT.add_view(OpenButtonsView(mapping, timeout=None))
+def register_persistent_items():
+    BOT.add_dynamic_items(OpenTicketButton, LegacyOpenTicketButton)
+    BOT.add_view(InTicketControlsView())
 
-@BOT.event
-async def on_ready():
-    ensure_files()
-    await rebuild_persistent_views()
+def command_tree_hash(guild: Optional[discord.Object]) -> str:
+    payload = [cmd.to_dict(TREE) for cmd in TREE.get_commands(guild=guild)]
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+async def sync_commands():
+    if SHARD_IDS is not None and 0 not in SHARD_IDS:
+        return
+    guild = discord.Object(id=SYNC_GUILD_ID) if SYNC_GUILD_ID else None
+    if guild:
+        TREE.copy_global_to(guild=guild)
+    scope = f"guild:{guild.id}" if guild else "global"
+    digest = command_tree_hash(guild)
+    if PROCESS.get("meta")["command_sync"].get(scope) == digest:
+        print(f"App commands unchanged ({scope}), skipping sync.")
+        return
     try:
-        synced = await TREE.sync()
-        print(f"Synced {len(synced)} app commands.")
+        synced = await TREE.sync(guild=guild)
+        print(f"Synced {len(synced)} app commands ({scope}).")
+        PROCESS.set("meta", ["command_sync", scope], digest)
     except Exception as e:
         print("Sync error:", e)
+
+def startup_report() -> list:
+    rows = []
+    for mode in ("full", "lean"):
+        run = PROCESS.get("meta").get("startup", {}).get(mode)
+        if run is None:
+            rows.append(f"member cache {mode}: no run recorded")
+            continue
+        current = " (current)" if mode == MEMBER_CACHE_MODE else ""
+        rows.append(f"member cache {mode}{current}: ready {run['ready_seconds']:.1f}s, "
+                    f"rss {run['rss_mb']:.0f}MB, {run['guilds']} guilds")
+    return rows
+
+@BOT.event
+async def on_ready():
+    if "ready" not in STARTUP_TIMINGS:
+        STARTUP_TIMINGS["ready"] = time.monotonic() - PROCESS_START
+        phases = ", ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in STARTUP_TIMINGS.items())
+        print(f"Startup timings: {phases}")
+        PROCESS.set("meta", ["startup", MEMBER_CACHE_MODE], {
+            "ready_seconds": round(STARTUP_TIMINGS["ready"], 3),
+            "rss_mb": round(resident_memory_mb(), 1),
+            "guilds": len(BOT.guilds),
+            "members_intent": INTENTS.members,
+            "at": int(time.time()),
+        })
+        for line in startup_report():
+            print(line)
     print(f"Logged in as {BOT.user} (ID: {BOT.user.id})")
 
+@BOT.listen("on_message")
+async def track_ticket_activity(message: discord.Message):
+    if message.author.bot or message.guild is None:
+        return
+    state = PARTITIONS.peek(message.guild.id)
+    if state is None and LIFECYCLE.wants_activity(message.guild.id):
+        state = await PARTITIONS.get(message.guild.id)
+    if state is not None:
+        LIFECYCLE.touch(state, message.channel.id)
+
 @TREE.command(name="role-manshen", description="تحديد رتبة يتم منشنها عند فتح تذكرة")
+@app_commands.guild_only()
 @app_commands.describe(role="اختر الرتبة")
+@instrumented("role-manshen")
 async def role_manshen(interaction: discord.Interaction, role: discord.Role):
-    config = load_json("config")
-    config["mention_role_id"] = role.id
-    save_json("config", config)
+    state = await PARTITIONS.get(interaction.guild_id)
+    state.set("config", ["mention_role_id"], role.id)
     await interaction.response.send_message(f"✅ سيتم منشن {role.mention} عند فتح أي تذكرة.", ephemeral=True)
 
 @TREE.command(name="write-in-ticket", description="تحديد رتبة مسموح لها الكتابة دائمًا في أي تذكرة")
+@app_commands.guild_only()
 @app_commands.describe(role="اختر الرتبة")
+@instrumented("write-in-ticket")
 async def write_in_ticket(interaction: discord.Interaction, role: discord.Role):
-    config = load_json("config")
-    config["write_role_id"] = role.id
-    save_json("config", config)
+    state = await PARTITIONS.get(interaction.guild_id)
+    state.set("config", ["write_role_id"], role.id)
     await interaction.response.send_message(f"✅ رتبة {role.mention} يمكنها الكتابة دائمًا داخل التذاكر.", ephemeral=True)
 
 @TREE.command(name="message-receipt", description="تحديد رسالة تظهر عند استلام التذكرة (الزر الأخضر)")
+@app_commands.guild_only()
 @app_commands.describe(text="نص رسالة الاستلام")
+@instrumented("message-receipt")
 async def message_receipt(interaction: discord.Interaction, text: app_commands.Range[str, 1, 1024]):
-    config = load_json("config")
-    config["receipt_message"] = text
-    save_json("config", config)
+    state = await PARTITIONS.get(interaction.guild_id)
+    state.set("config", ["receipt_message"], text)
     await interaction.response.send_message("✅ تم تحديث رسالة الاستلام.", ephemeral=True)
 
 @TREE.command(name="name-button-ticket", description="تغيير أسماء الأزرار داخل التذكرة (استلام/قفل)")
+@app_commands.guild_only()
 @app_commands.describe(accept_label="اسم زر الاستلام (الأخضر)", close_label="اسم زر القفل (الأحمر)")
+@instrumented("name-button-ticket")
 async def name_button_ticket(interaction: discord.Interaction,
                              accept_label: app_commands.Range[str, 1, 80],
                              close_label: app_commands.Range[str, 1, 80]):
-    config = load_json("config")
-    config["in_ticket_buttons"]["accept_label"] = accept_label
-    config["in_ticket_buttons"]["close_label"] = close_label
-    save_json("config", config)
+    state = await PARTITIONS.get(interaction.guild_id)
+    state.set("config", ["in_ticket_buttons", "accept_label"], accept_label)
+    state.set("config", ["in_ticket_buttons", "close_label"], close_label)
+    state.set("config", ["controls_version"], state.get("config").get("controls_version", 0) + 1)
     await interaction.response.send_message("✅ تم تحديث أسماء الأزرار داخل التذكرة.", ephemeral=True)
+    pending = RENDERER.schedule(state, interaction)
+    if pending:
+        with contextlib.suppress(discord.HTTPException):
+            await interaction.edit_original_response(
+                content=f"✅ تم تحديث أسماء الأزرار داخل التذكرة. سيتم تحديث {pending} رسالة في الخلفية."
+            )
 
 @TREE.command(name="message-ticket", description="ضبط/حذف الرسالة التلقائية عند فتح تذكرة في كاتيجوري معين")
+@app_commands.guild_only()
 @app_commands.describe(category="اختر الكاتيجوري", text="نص الرسالة (اختياري)", image_url="رابط صورة (اختياري)", delete="حذف الرسالة التلقائية؟")
+@instrumented("message-ticket")
 async def message_ticket(interaction: discord.Interaction,
                          category: discord.CategoryChannel,
                          text: Optional[app_commands.Range[str, 1, 1024]] = None,
                          image_url: Optional[str] = None,
                          delete: Optional[bool] = False):
-    categories = load_json("categories")
+    state = await PARTITIONS.get(interaction.guild_id)
+    categories = state.get("categories")
     key = str(category.id)
     if delete:
         if key in categories:
-            categories[key].pop("auto_message", None)
+            state.delete("categories", [key, "auto_message"])
             if not categories[key]:
-                categories.pop(key, None)
-        save_json("categories", categories)
+                state.delete("categories", [key])
         return await interaction.response.send_message("🗑️ تم حذف الرسالة التلقائية لهذه الكاتيجوري.", ephemeral=True)
-    categories.setdefault(key, {})
-    categories[key]["auto_message"] = {"text": text or "", "image": image_url or None}
-    save_json("categories", categories)
+    state.set("categories", [key, "auto_message"], {"text": text or "", "image": image_url or None})
     await interaction.response.send_message("✅ تم حفظ الرسالة التلقائية لهذه الكاتيجوري.", ephemeral=True)
 
 @TREE.command(name="new-ticket", description="إرسال رسالة مع زر/أزرار فتح تذكرة")
+@app_commands.guild_only()
 @app_commands.describe(
     message="النص الذي سيظهر في الإيمبد",
     button_label="اسم الزر (مثال: الدعم الفني)",
     category="الكاتيجوري الذي ستفتح فيه التذكرة",
     button_color="لون الزر: green/red/blue/gray/white"
 )
+@instrumented("new-ticket")
 async def new_ticket(interaction: discord.Interaction,
                      message: app_commands.Range[str, 1, 1024],
                      button_label: app_commands.Range[str, 1, 80],
                      category: discord.CategoryChannel,
-                     button_color: app_commands.Choice[str] = app_commands.Choice(name="green", value="green")):
+                     button_color: str = "green"):
     await interaction.response.defer(ephemeral=True)
+    state = await PARTITIONS.get(interaction.guild_id)
     embed = discord.Embed(title="📨 فتح تذكرة", description=message, color=discord.Color.blurple())
     embed.set_footer(text=f"بواسطة: {interaction.user.display_name}")
-    mapping = [(button_label, button_color.value, category.id)]
+    mapping = [(button_label, button_color, category.id)]
     view = OpenButtonsView(mapping, timeout=None)
     msg = await interaction.channel.send(embed=embed, view=view)
-    buttons = load_json("buttons")
-    buttons[str(msg.id)] = [{"label": button_label, "style": button_color.value, "category_id": category.id}]
-    save_json("buttons", buttons)
+    state.set("buttons", [msg.id], [{"label": button_label, "style": button_color, "category_id": category.id}])
+    state.set("panels", [msg.id], {"channel_id": msg.channel.id, "version": PANEL_RENDER_VERSION})
     await interaction.followup.send("✅ تم إرسال رسالة فتح التذكرة.", ephemeral=True)
 
 @new_ticket.autocomplete("button_color")
@@ -304,102 +2076,203 @@ async def color_autocomplete(interaction: discord.Interaction, current: str):
     options = ["green", "red", "blue", "gray", "white"]
     return [app_commands.Choice(name=o, value=o) for o in options if current.lower() in o][:5]
 
+def color_choice_param():
+    return [
+        app_commands.Choice(name="green", value="green"),
+        app_commands.Choice(name="red", value="red"),
+        app_commands.Choice(name="blue", value="blue"),
+        app_commands.Choice(name="gray", value="gray"),
+        app_commands.Choice(name="white", value="white"),
+    ]
+
 @TREE.command(name="add-button-ticket", description="إضافة زر فتح تذكرة لرسالة موجودة")
+@app_commands.guild_only()
+@app_commands.choices(button_color=color_choice_param())
 @app_commands.describe(
     message_id="ID الرسالة التي تريد إضافة زر لها",
     button_label="اسم الزر الجديد",
     category="الكاتيجوري الذي ستفتح فيه التذكرة",
     button_color="لون الزر: green/red/blue/gray/white"
 )
+@instrumented("add-button-ticket")
 async def add_button_ticket(interaction: discord.Interaction,
                             message_id: app_commands.Range[str, 1, 30],
                             button_label: app_commands.Range[str, 1, 80],
                             category: discord.CategoryChannel,
-                            button_color: app_commands.Choice[str] = app_commands.Choice(name="blue", value="blue")):
+                            button_color: str = "blue"):
     await interaction.response.defer(ephemeral=True)
-    buttons = load_json("buttons")
+    state = await PARTITIONS.get(interaction.guild_id)
+    buttons = state.get("buttons")
     if message_id not in buttons:
         return await interaction.followup.send("❌ لم أجد تعريف أزرار لهذه الرسالة. تأكد من ID.", ephemeral=True)
+    panel = state.get("panels").get(message_id)
+    if panel is not None:
+        msg = RENDERER.partial_message(state, panel["channel_id"], int(message_id))
+    else:
+        try:
+            msg = await interaction.channel.fetch_message(int(message_id))
+        except Exception:
+            return await interaction.followup.send("❌ لم أستطع جلب الرسالة. تأكد أنك في نفس القناة أو أعطني صلاحيات.", ephemeral=True)
+        RENDERER.register_panel(state, msg)
+    btn_list = buttons[message_id] + [{"label": button_label, "style": button_color, "category_id": category.id}]
     try:
-        msg = await interaction.channel.fetch_message(int(message_id))
-    except Exception:
-        return await interaction.followup.send("❌ لم أستطع جلب الرسالة. تأكد أنك في نفس القناة أو أعطني صلاحيات.", ephemeral=True)
-    btn_list = buttons[message_id]
-    btn_list.append({"label": button_label, "style": button_color.value, "category_id": category.id})
-    save_json("buttons", buttons)
-    mapping = [(b["label"], b["style"], int(b["category_id"])) for b in btn_list]
-    view = OpenButtonsView(mapping, timeout=None)
-    await msg.edit(view=view)
+        await msg.edit(view=panel_view(btn_list))
+    except discord.NotFound:
+        state.delete("panels", [message_id])
+        return await interaction.followup.send("❌ رسالة الأزرار لم تعد موجودة.", ephemeral=True)
+    state.set("buttons", [message_id], btn_list)
+    state.set("panels", [message_id, "version"], PANEL_RENDER_VERSION)
     await interaction.followup.send("✅ تم إضافة الزر إلى الرسالة.", ephemeral=True)
 
 @TREE.command(name="rename", description="تغيير اسم قناة التذكرة")
+@app_commands.guild_only()
 @app_commands.describe(name="الاسم الجديد")
+@instrumented("rename")
+@single_flight("rename", "name")
 async def rename_ticket(interaction: discord.Interaction, name: app_commands.Range[str, 1, 90]):
-    tickets = load_json("tickets")
-    info = tickets.get(str(interaction.channel.id))
-    if not info:
-        return await interaction.response.send_message("❌ هذه ليست قناة تذكرة.", ephemeral=True)
-    if interaction.user.id == info["owner_id"]:
-        return await interaction.response.send_message("❌ لا يمكنك استعمال هذا الأمر. فقط المسؤول عن التذكرة.", ephemeral=True)
-    if not can_use_admin_commands(interaction, info):
-        return await interaction.response.send_message("❌ ليس لديك صلاحية لإعادة التسمية.", ephemeral=True)
-    await interaction.channel.edit(name=name, reason="إعادة تسمية التذكرة")
-    await interaction.response.send_message(f"✏️ تم تغيير الاسم إلى `{name}`.", ephemeral=True)
+    state = await PARTITIONS.get(interaction.guild_id)
+    async with TICKET_LOCKS.hold(interaction.channel.id):
+        info = get_open_ticket(state, interaction.channel.id)
+        if not info:
+            return await interaction.response.send_message("❌ هذه ليست قناة تذكرة.", ephemeral=True)
+        if interaction.user.id == info["owner_id"]:
+            return await interaction.response.send_message("❌ لا يمكنك استعمال هذا الأمر. فقط المسؤول عن التذكرة.", ephemeral=True)
+        if not can_use_admin_commands(interaction, info):
+            return await interaction.response.send_message("❌ ليس لديك صلاحية لإعادة التسمية.", ephemeral=True)
+        await interaction.channel.edit(name=name, reason="إعادة تسمية التذكرة")
+        await interaction.response.send_message(f"✏️ تم تغيير الاسم إلى `{name}`.", ephemeral=True)
 
 @TREE.command(name="close", description="إغلاق (حذف) قناة التذكرة الحالية")
+@app_commands.guild_only()
+@instrumented("close")
+@single_flight("close")
 async def close_ticket_cmd(interaction: discord.Interaction):
-    tickets = load_json("tickets")
-    info = tickets.get(str(interaction.channel.id))
-    if not info:
-        return await interaction.response.send_message("❌ هذه ليست قناة تذكرة.", ephemeral=True)
-    if interaction.user.id == info["owner_id"]:
-        return await interaction.response.send_message("❌ لا يمكنك إغلاق التذكرة. فقط المسؤول/المستلم.", ephemeral=True)
-    if not can_use_admin_commands(interaction, info):
-        return await interaction.response.send_message("❌ ليس لديك صلاحية لإغلاق التذكرة.", ephemeral=True)
+    state = await PARTITIONS.get(interaction.guild_id)
+    async with TICKET_LOCKS.hold(interaction.channel.id):
+        info = get_open_ticket(state, interaction.channel.id)
+        if not info:
+            return await interaction.response.send_message("❌ هذه ليست قناة تذكرة.", ephemeral=True)
+        if interaction.user.id == info["owner_id"]:
+            return await interaction.response.send_message("❌ لا يمكنك إغلاق التذكرة. فقط المسؤول/المستلم.", ephemeral=True)
+        if not can_use_admin_commands(interaction, info):
+            return await interaction.response.send_message("❌ ليس لديك صلاحية لإغلاق التذكرة.", ephemeral=True)
+        CLOSING_TICKETS.add(interaction.channel.id)
     await interaction.response.send_message("🗑️ سيتم حذف القناة بعد 3 ثوانٍ...")
-    await asyncio.sleep(3)
-    try:
-        del tickets[str(interaction.channel.id)]
-        save_json("tickets", tickets)
-    except KeyError:
-        pass
-    await interaction.channel.delete(reason="إغلاق التذكرة")
+    LIFECYCLE.schedule_delete(state, interaction.channel.id, 3)
 
 @TREE.command(name="convert", description="نقل استلام التذكرة لشخص آخر")
+@app_commands.guild_only()
 @app_commands.describe(user="الشخص الذي سيتسلم التذكرة بدلًا من الحالي")
+@instrumented("convert")
+@single_flight("convert", "user")
 async def convert_ticket(interaction: discord.Interaction, user: discord.Member):
-    tickets = load_json("tickets")
-    info = tickets.get(str(interaction.channel.id))
-    if not info:
-        return await interaction.response.send_message("❌ هذه ليست قناة تذكرة.", ephemeral=True)
-    if interaction.user.id == info["owner_id"]:
-        return await interaction.response.send_message("❌ لا يمكنك استعمال هذا الأمر لأنك صاحب التذكرة.", ephemeral=True)
-    if not can_use_admin_commands(interaction, info):
-        return await interaction.response.send_message("❌ ليس لديك صلاحية لنقل التذكرة.", ephemeral=True)
-    config = load_json("config")
-    write_role_id = config.get("write_role_id")
-    write_role = interaction.guild.get_role(write_role_id) if write_role_id else None
-    owner = interaction.guild.get_member(info["owner_id"])
-    info["handler_id"] = user.id
-    save_json("tickets", tickets)
-    await set_ticket_permissions(interaction.channel, owner, user, write_role, locked=True)
-    await interaction.response.send_message(f"🔄 تم تحويل التذكرة إلى {user.mention}.")
+    state = await PARTITIONS.get(interaction.guild_id)
+    async with TICKET_LOCKS.hold(interaction.channel.id):
+        info = get_open_ticket(state, interaction.channel.id)
+        if not info:
+            return await interaction.response.send_message("❌ هذه ليست قناة تذكرة.", ephemeral=True)
+        if interaction.user.id == info["owner_id"]:
+            return await interaction.response.send_message("❌ لا يمكنك استعمال هذا الأمر لأنك صاحب التذكرة.", ephemeral=True)
+        if not can_use_admin_commands(interaction, info):
+            return await interaction.response.send_message("❌ ليس لديك صلاحية لنقل التذكرة.", ephemeral=True)
+        config = state.get("config")
+        write_role_id = config.get("write_role_id")
+        write_role = interaction.guild.get_role(write_role_id) if write_role_id else None
+        owner = await MEMBERS.resolve(interaction.guild, info["owner_id"])
+        previous_handler_id = info.get("handler_id")
+        STATS.assigned(state, interaction.channel.id, info, user.id)
+        state.set("tickets", [interaction.channel.id, "handler_id"], user.id)
+        await set_ticket_permissions(interaction.channel, owner, user, write_role, locked=True,
+                                     previous_handler_id=previous_handler_id)
+        await interaction.response.send_message(f"🔄 تم تحويل التذكرة إلى {user.mention}.")
     try:
         await interaction.channel.send(f"ℹ️ تم تحويل التذكرة إلى {user.mention}.")
     except discord.Forbidden:
         pass
 
-def color_choice_param():
-    return [
-        app_commands.Choice(name="green", value="green"),
-        app_commands.Choice(name="red", value="red"),
-        app_commands.Choice(name="blue", value="blue"),
-        app_commands.Choice(name="gray", value="gray"),
-        app_commands.Choice(name="white", value="white"),
-    ]
+@TREE.command(name="transcript", description="جلب نسخة محفوظة من تذكرة مغلقة")
+@app_commands.guild_only()
+@app_commands.describe(ticket_id="ID قناة التذكرة")
+@instrumented("transcript")
+async def transcript_cmd(interaction: discord.Interaction, ticket_id: app_commands.Range[str, 1, 30]):
+    if not interaction.user.guild_permissions.manage_channels:
+        return await interaction.response.send_message("❌ ليس لديك صلاحية.", ephemeral=True)
+    if not ticket_id.isdigit():
+        return await interaction.response.send_message("❌ ID غير صالح.", ephemeral=True)
+    paths = transcript_files(interaction.guild_id, int(ticket_id))
+    paths = {kind: path for kind, path in paths.items() if os.path.exists(path)}
+    if "jsonl" not in paths:
+        return await interaction.response.send_message("❌ لا توجد نسخة محفوظة لهذه التذكرة.", ephemeral=True)
+    entry = await asyncio.to_thread(find_transcript, interaction.guild_id, int(ticket_id))
+    budget = interaction.guild.filesize_limit
+    files, too_large = [], []
+    for path in paths.values():
+        size = os.path.getsize(path)
+        if size <= budget:
+            budget -= size
+            files.append(discord.File(path))
+        else:
+            too_large.append(f"`{path}` ({size} بايت)")
+    text = f"📄 {sum(os.path.getsize(p) for p in paths.values())} بايت."
+    if entry:
+        text += f" {entry['messages']} رسالة، أُغلقت <t:{entry['closed_at']}:f>."
+    if too_large:
+        text += "\n⚠️ ملفات أكبر من حد الرفع، موجودة على الخادم في:\n" + "\n".join(too_large)
+    await interaction.response.send_message(text, files=files, ephemeral=True)
+
+@TREE.command(name="bot-metrics", description="عرض مقاييس أداء البوت")
+@app_commands.guild_only()
+@instrumented("bot-metrics")
+async def bot_metrics(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.manage_channels:
+        return await interaction.response.send_message("❌ ليس لديك صلاحية.", ephemeral=True)
+    rows = []
+    for (name, labels), hist in sorted(METRICS.histograms.items(), key=lambda kv: kv[0]):
+        if name not in ("ticket_handler_seconds", "interaction_response_seconds", "rest_call_seconds"):
+            continue
+        label = ",".join(str(v) for _, v in labels)
+        rows.append(f"{name[:-8]} {label}: n={hist.count} p50≤{hist.quantile(0.5) * 1000:.0f}ms p99≤{hist.quantile(0.99) * 1000:.0f}ms")
+    waits = METRICS.counters.get(("rate_limit_waits_total", ()), 0)
+    waited = METRICS.counters.get(("rate_limit_wait_seconds_total", ()), 0.0)
+    rows.append(f"rate limits: {int(waits)} waits, {waited:.1f}s")
+    lookups = {dict(labels)["source"]: int(v) for (name, labels), v in METRICS.counters.items() if name == "member_lookups_total"}
+    rows.append(f"members ({MEMBER_CACHE_MODE}): rss {resident_memory_mb():.0f}MB, lookups {lookups}")
+    rows.extend(startup_report())
+    text = "\n".join(rows)[-1900:]
+    await interaction.response.send_message(f"```\n{text}\n```", ephemeral=True)
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "—"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f}د"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f}س"
+    return f"{seconds / 86400:.1f}ي"
+
+@TREE.command(name="ticket-stats", description="عرض إحصائيات التذاكر المفتوحة وأوقات الاستلام والإغلاق")
+@app_commands.guild_only()
+@instrumented("ticket-stats")
+async def ticket_stats(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.manage_channels:
+        return await interaction.response.send_message("❌ ليس لديك صلاحية.", ephemeral=True)
+    state = await PARTITIONS.get(interaction.guild_id)
+    stats = state.get("stats")
+    by_category = sorted(stats["open_by_category"].items(), key=lambda kv: -kv[1])
+    by_handler = sorted(stats["open_by_handler"].items(), key=lambda kv: -kv[1])
+    embed = discord.Embed(title="📊 إحصائيات التذاكر", color=discord.Color.blurple())
+    embed.add_field(name="التذاكر المفتوحة", value=str(sum(stats["open_by_category"].values())), inline=False)
+    categories = [f"<#{key}>: {count}" if key != UNASSIGNED else f"بدون كاتيجوري: {count}" for key, count in by_category[:10]]
+    embed.add_field(name="حسب الكاتيجوري", value="\n".join(categories) or "—", inline=True)
+    handlers = [f"<@{key}>: {count}" if key != UNASSIGNED else f"غير مستلمة: {count}" for key, count in by_handler[:10]]
+    embed.add_field(name="حسب المستلم", value="\n".join(handlers) or "—", inline=True)
+    for sketch, title in (("time_to_accept", "وقت الاستلام"), ("time_to_close", "وقت الإغلاق")):
+        buckets = stats[sketch]
+        value = " / ".join(format_duration(sketch_quantile(buckets, q)) for q in (0.5, 0.9, 0.99))
+        embed.add_field(name=f"{title} (p50 / p90 / p99)", value=f"{value} (n={sum(buckets.values())})", inline=False)
+    await interaction.response.send_message(embed=embed, ephemeral=True)
 
 if __name__ == "__main__":
-    ensure_files()
     token = os.getenv("DISCORD_BOT_TOKEN") or "PUT_YOUR_TOKEN_HERE"
     if token == "MTM5NDA5MDg2MzI2ODcyODkxMw.G7NNjd.szCJIVbvLaLacfVmfndFz_iLDssrVWENUJqfbs":
         print("⚠️ ضع توكن البوت في متغير البيئة DISCORD_BOT_TOKEN أو بدّل النص في الملف.")
@@ -0,0 +1,109 @@
+import os
+import json
+import asyncio
+import threading
+import importlib.util
+
+import pytest
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "newfile (1).py")
+
+@pytest.fixture(scope="module")
+def bot():
+    spec = importlib.util.spec_from_file_location("ticketbot", BOT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def make_store(bot, root):
+    defaults = {"tickets": {}, "config": {"inactivity": {"warn_hours": 0}}}
+    files = {name: os.path.join(root, f"{name}.json") for name in defaults}
+    return bot.StateStore(files, defaults, os.path.join(root, "journal.jsonl"))
+
+def write_ops(store, start: int, count: int):
+    for i in range(start, start + count):
+        store.set("tickets", [i], {"owner_id": i, "handler_id": None})
+        if i % 3 == 0:
+            store.delete("tickets", [i - 1])
+    store.set("config", ["inactivity", "warn_hours"], start + count)
+
+def reload(bot, root) -> dict:
+    store = make_store(bot, root)
+    store.load()
+    data = store.data
+    store._journal.close()
+    return data
+
+def test_replay_after_crash_following_rotation(bot, tmp_path, monkeypatch):
+    async def scenario():
+        store = make_store(bot, str(tmp_path))
+        store.load()
+        write_ops(store, 1, 50)
+        await store.compact()
+        write_ops(store, 51, 50)
+
+        def crash(*args, **kwargs):
+            raise SystemExit("crashed before the snapshot was written")
+
+        monkeypatch.setattr(store, "_persist", crash)
+        with pytest.raises(SystemExit):
+            await store.compact()
+        write_ops(store, 101, 10)
+        store._journal.close()
+        return json.loads(json.dumps(store.data))
+
+    expected = asyncio.run(scenario())
+    assert os.path.exists(os.path.join(tmp_path, "journal.jsonl.1"))
+    assert reload(bot, str(tmp_path)) == expected
+
+def test_replay_after_crash_during_persist(bot, tmp_path, monkeypatch):
+    async def scenario():
+        store = make_store(bot, str(tmp_path))
+        store.load()
+        write_ops(store, 1, 80)
+        persist = store._persist
+
+        def crash(snapshots, drop_journal):
+            first = dict(list(snapshots.items())[:1])
+            persist(first, drop_journal)
+            raise SystemExit("crashed after writing one snapshot")
+
+        monkeypatch.setattr(store, "_persist", crash)
+        with pytest.raises(SystemExit):
+            await store.compact()
+        write_ops(store, 81, 10)
+        store._journal.close()
+        return json.loads(json.dumps(store.data))
+
+    expected = asyncio.run(scenario())
+    assert reload(bot, str(tmp_path)) == expected
+
+def test_compaction_leaves_live_state_alone(bot, tmp_path, monkeypatch):
+    async def scenario():
+        loop_thread = threading.get_ident()
+        store = make_store(bot, str(tmp_path))
+        store.load()
+        write_ops(store, 1, 20)
+        dump = bot.dump_document
+
+        def off_loop_dump(value, f):
+            assert threading.get_ident() != loop_thread
+            dump(value, f)
+
+        monkeypatch.setattr(bot, "dump_document", off_loop_dump)
+        await store.compact()
+        write_ops(store, 21, 5)
+        await store.close()
+        return json.loads(json.dumps(store.data))
+
+    expected = asyncio.run(scenario())
+    monkeypatch.undo()
+    assert not os.path.exists(os.path.join(tmp_path, "journal.jsonl.1"))
+    assert reload(bot, str(tmp_path)) == expected
+    with open(os.path.join(tmp_path, "tickets.json"), "r", encoding="utf-8") as f:
+        assert json.load(f) == expected["tickets"]
+
+def test_legacy_compact_snapshots_still_load(bot, tmp_path):
+    with open(os.path.join(tmp_path, "tickets.json"), "w", encoding="utf-8") as f:
+        json.dump({"1": {"owner_id": 1}}, f)
+    assert reload(bot, str(tmp_path))["tickets"] == {"1": {"owner_id": 1}}